@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+"""Memory blocks allocated per request by the scan loop itself, with the network taken out.
+
+    python3 -m bench.allocations -n 20000
+
+Every request is queued against a single target with a fetch that waits until all of them are queued and then
+answers 404 at once, so only the bookkeeping of the scanner is measured: blocks held per queued request, blocks
+left behind per completed request, garbage collector runs and CPU time per request.
+"""
+
+import asyncio
+import gc
+import sys
+import tempfile
+from time import process_time
+
+import click
+
+from bench.harness import SCRIPT_PATH
+from lib.config import Config
+from lib.response import ScanResponse
+from lib.scan_manager import ScanManager
+from lib.scan_target import prepare_targets
+
+
+class StubScanManager(ScanManager):
+    def __init__(self, config, targets):
+        super().__init__(config, targets)
+        self.gate = self.loop.create_future()
+
+    async def fetch(self, target_id, url, calibration=False, attempt=0):
+        await self.gate
+        return target_id, ScanResponse(url=url, path=url, status=404, content_length=0, location=None, digest=None,
+                                       latency=0.0)
+
+
+async def measure(manager, target, requests):
+    collections = [0]
+
+    def count_collection(phase, info):
+        if phase == "start":
+            collections[0] += 1
+
+    manager.start_target(target)
+    url = target.target_url + "/nothing"
+    gc.collect()
+    gc.callbacks.append(count_collection)
+    blocks = sys.getallocatedblocks()
+    cpu = process_time()
+    for index in range(requests):
+        manager.create_task(target.target_id, url, index)
+    await asyncio.sleep(0)  # Every request runs up to the gate
+    queued = sys.getallocatedblocks() - blocks
+    manager.gate.set_result(None)
+    while target.in_flight:
+        await asyncio.sleep(0)
+    cpu = process_time() - cpu
+    left = sys.getallocatedblocks() - blocks
+    gc.callbacks.remove(count_collection)
+    return {"queued": queued / requests, "left": left / requests, "collections": collections[0],
+            "cpu_per_request": cpu / requests}
+
+
+@click.command()
+@click.option('--requests', '-n', default=20000, show_default=True, help="How many requests to queue")
+def main(requests):
+    with tempfile.TemporaryDirectory() as logs:
+        config = Config(SCRIPT_PATH, ["-u", "http://127.0.0.1:9", "-l", logs, "--no-calibrate"])
+        config.path_stats = None
+        target = prepare_targets(config)[0]
+        manager = StubScanManager(config, [])
+        r = manager.loop.run_until_complete(measure(manager, target, requests))
+        manager.pbar.close()
+    click.echo(f"{'requests':>9} {'blocks/queued':>14} {'blocks left/req':>16} {'gc runs':>8} {'CPU/req':>9}")
+    click.echo(f"{requests:>9} {r['queued']:>14.1f} {r['left']:>16.2f} {r['collections']:>8} "
+               f"{r['cpu_per_request'] * 1e6:>7.1f}us")
+
+
+if __name__ == "__main__":
+    main()
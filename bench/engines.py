@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+"""Requests per second and per CPU core of a real scan for every HTTP engine, against a local mock target.
+
+    python3 -m bench.engines --hosts 8 -m 512 -M 64
+
+Requests per core is the number of requests one fully busy core of the scanner process would send per second,
+i.e. requests divided by the CPU time of the scanner. The mock target runs in its own process and is not counted.
+"""
+
+import json
+import subprocess
+import sys
+import tempfile
+
+import click
+
+from bench.harness import SCRIPT_PATH, measure, start_mock_server, write_url_list
+from lib.raw_http import ENGINES
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", show_default=True)
+@click.option('--port', default=18080, show_default=True)
+@click.option('--hosts', default=8, show_default=True, help="How many virtual hosts to scan")
+@click.option('--max-connections', '-m', default=512, show_default=True)
+@click.option('--max-connections-per-host', '-M', default=64, show_default=True)
+@click.option('--latency', default=0.0, show_default=True, help="Mean latency of the mock target, seconds")
+@click.option('--run', is_flag=True, hidden=True)
+@click.argument('scan_args', nargs=-1)
+def main(host, port, hosts, max_connections, max_connections_per_host, latency, run, scan_args):
+    """Compare the HTTP engines, extra SCAN_ARGS go to pidrila (after --)"""
+    if run:
+        print(json.dumps(measure(list(scan_args))))
+        return
+    server = start_mock_server(host, port, hosts, "--latency", str(latency))
+    try:
+        with tempfile.TemporaryDirectory() as logs:
+            url_list = write_url_list(logs, host, port, hosts)
+            click.echo(f"{'engine':>8} {'requests':>9} {'elapsed':>8} {'req/s':>9} {'CPU/req':>9} {'req/s/core':>11}")
+            for engine in ENGINES:
+                argv = ["-L", url_list, "-l", logs, "-m", str(max_connections), "-M", str(max_connections_per_host),
+                        "--engine", engine, "--no-calibrate", *scan_args]
+                # Every engine runs in a fresh interpreter
+                out = subprocess.run([sys.executable, "-m", "bench.engines", "--run", "--", *argv],
+                                     check=True, capture_output=True, text=True, cwd=SCRIPT_PATH).stdout
+                r = json.loads(out.splitlines()[-1])
+                per_core = 1 / r['cpu_per_request'] if r['cpu_per_request'] else 0.0
+                click.echo(f"{engine:>8} {r['requests']:>9} {r['elapsed']:>7.1f}s {r['rps']:>9.1f} "
+                           f"{r['cpu_per_request'] * 1e6:>7.1f}us {per_core:>11.0f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
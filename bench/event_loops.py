@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+"""Requests per second of a real scan for every event loop backend, against a local mock target.
+
+    python3 -m bench.event_loops --hosts 8 -m 512
+"""
+
+import json
+import subprocess
+import sys
+import tempfile
+
+import click
+
+from bench.harness import SCRIPT_PATH, run_scan, start_mock_server, write_url_list
+from lib.event_loop import LOOP_BACKENDS
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", show_default=True)
+@click.option('--port', default=18080, show_default=True)
+@click.option('--hosts', default=8, show_default=True, help="How many virtual hosts to scan")
+@click.option('--max-connections', '-m', default=512, show_default=True)
+@click.option('--latency', default=0.0, show_default=True, help="Mean latency of the mock target, seconds")
+@click.option('--run', type=click.Choice(LOOP_BACKENDS), hidden=True)
+@click.argument('scan_args', nargs=-1)
+def main(host, port, hosts, max_connections, latency, run, scan_args):
+    if run:
+        manager = run_scan(list(scan_args))
+        print(json.dumps({"backend": manager.loop_backend, "requests": manager.meter.total,
+                          "elapsed": manager.meter.elapsed, "rps": manager.meter.average}))
+        return
+    server = start_mock_server(host, port, hosts, "--latency", str(latency))
+    try:
+        with tempfile.TemporaryDirectory() as logs:
+            url_list = write_url_list(logs, host, port, hosts)
+            click.echo(f"{'backend':>8} {'requests':>9} {'elapsed':>8} {'req/s':>9}")
+            fallback = False
+            for backend in ("asyncio", "uvloop"):
+                argv = ["-L", url_list, "-l", logs, "-m", str(max_connections), "-M", str(max_connections),
+                        "--event-loop", backend, "--no-calibrate", *scan_args]
+                # Every backend runs in a fresh interpreter
+                out = subprocess.run([sys.executable, "-m", "bench.event_loops", "--run", backend, "--", *argv],
+                                     check=True, capture_output=True, text=True, cwd=SCRIPT_PATH).stdout
+                r = json.loads(out.splitlines()[-1])
+                fallback = fallback or r["backend"] != backend
+                name = backend if r["backend"] == backend else f"{backend}*"
+                click.echo(f"{name:>8} {r['requests']:>9} {r['elapsed']:>7.1f}s {r['rps']:>9.1f}")
+            if fallback:
+                click.echo("* backend not installed, fell back to asyncio")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+"""Throughput benchmark of a full scan against a local mock target.
+
+    python3 -m bench --hosts 16 --latency 0.02 -m 256 -m 1024 -M 16 -M 64
+
+Every combination of -m, -M and --chunk-size runs in a fresh interpreter and reports req/s, p50/p99
+latency, peak RSS and CPU time per request of the scanner process.
+"""
+
+import itertools
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+from time import sleep
+
+import click
+
+from lib.config import Config
+from lib.scan_manager import ScanManager
+from lib.scan_target import prepare_targets
+
+SCRIPT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def wait_for_port(host, port, timeout=10.0):
+    for _ in range(int(timeout / 0.1)):
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise click.ClickException(f"mock server did not start on {host}:{port}")
+
+
+def start_mock_server(host, port, hosts, *args):
+    server = subprocess.Popen([sys.executable, "-m", "bench.mock_server", "--host", host, "--port", str(port),
+                               "--hosts", str(hosts), *args], stdout=subprocess.DEVNULL, cwd=SCRIPT_PATH)
+    wait_for_port(host, port + hosts - 1)
+    return server
+
+
+def write_url_list(directory, host, port, hosts):
+    path = os.path.join(directory, "urls.txt")
+    with open(path, "w") as f:
+        f.writelines(f"http://{host}:{p}\n" for p in range(port, port + hosts))
+    return path
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class BenchScanManager(ScanManager):
+    def __init__(self, config, targets):
+        self.latencies = []
+        super().__init__(config, targets)
+
+    def handle_response(self, packed):
+        if not isinstance(packed[1], Exception):
+            self.latencies.append(packed[1].latency)
+        return super().handle_response(packed)
+
+
+def run_scan(argv, manager_class=ScanManager):
+    config = Config(SCRIPT_PATH, argv)
+    config.path_stats = None  # Mock server hits must not end up in the statistics of real scans
+    manager = manager_class(config, prepare_targets(config))
+    manager.run_loop()
+    return manager
+
+
+def measure(argv):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = usage.ru_utime + usage.ru_stime
+    manager = run_scan(argv, BenchScanManager)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    latencies = sorted(manager.latencies)
+    requests = manager.meter.total
+    return {"requests": requests, "elapsed": manager.meter.elapsed, "rps": manager.meter.average,
+            "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99), "rss": usage.ru_maxrss,
+            "cpu_per_request": (usage.ru_utime + usage.ru_stime - cpu_before) / requests if requests else 0.0}
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", show_default=True)
+@click.option('--port', default=18080, show_default=True)
+@click.option('--hosts', default=8, show_default=True, help="How many virtual hosts to scan")
+@click.option('--latency', default=0.0, show_default=True, help="Mean latency of the mock target, seconds")
+@click.option('--not-found-ratio', default=0.99, show_default=True, help="Share of paths answered with 404")
+@click.option('--error-rate', default=0.0, show_default=True, help="Share of requests answered with 503")
+@click.option('--wildcard-hosts', default=0, show_default=True, help="How many hosts answer every path")
+@click.option('--keepalive-drop', default=0.0, show_default=True,
+              help="Share of responses followed by closing the connection")
+@click.option('--max-connections', '-m', multiple=True, type=int, default=(512,), show_default=True)
+@click.option('--max-connections-per-host', '-M', multiple=True, type=int, default=(64,), show_default=True)
+@click.option('--chunk-size', multiple=True, type=int, default=(65535,), show_default=True)
+@click.option('--run', is_flag=True, hidden=True)
+@click.argument('scan_args', nargs=-1)
+def main(host, port, hosts, latency, not_found_ratio, error_rate, wildcard_hosts, keepalive_drop, max_connections,
+         max_connections_per_host, chunk_size, run, scan_args):
+    """Benchmark PIDRILA against a local mock target, extra SCAN_ARGS go to pidrila (after --)"""
+    if run:
+        print(json.dumps(measure(list(scan_args))))
+        return
+    server = start_mock_server(host, port, hosts, "--latency", str(latency), "--not-found-ratio", str(not_found_ratio),
+                               "--error-rate", str(error_rate), "--wildcard-hosts", str(wildcard_hosts),
+                               "--keepalive-drop", str(keepalive_drop))
+    try:
+        with tempfile.TemporaryDirectory() as logs:
+            url_list = write_url_list(logs, host, port, hosts)
+            click.echo(f"{'-m':>6} {'-M':>5} {'chunk':>6} {'requests':>9} {'req/s':>9} {'p50':>8} {'p99':>8} "
+                       f"{'RSS':>8} {'CPU/req':>9}")
+            for m, per_host, chunk in itertools.product(max_connections, max_connections_per_host, chunk_size):
+                argv = ["-L", url_list, "-l", logs, "-m", str(m), "-M", str(per_host), "--chunk-size", str(chunk),
+                        *scan_args]
+                out = subprocess.run([sys.executable, "-m", "bench", "--run", "--", *argv],
+                                     check=True, capture_output=True, text=True, cwd=SCRIPT_PATH).stdout
+                r = json.loads(out.splitlines()[-1])
+                click.echo(f"{m:>6} {per_host:>5} {chunk:>6} {r['requests']:>9} {r['rps']:>9.1f} "
+                           f"{r['p50'] * 1000:>6.1f}ms {r['p99'] * 1000:>6.1f}ms {r['rss'] / 1024:>6.1f}Mi "
+                           f"{r['cpu_per_request'] * 1e6:>7.1f}us")
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+"""Local HTTP target for benchmarks: every port is a separate virtual host.
+
+    python3 -m bench.mock_server --port 18080 --hosts 8 --latency 0.01 --error-rate 0.01 --wildcard-hosts 1
+"""
+
+import asyncio
+import random
+from urllib.parse import quote
+from zlib import crc32
+
+import click
+from aiohttp import web
+
+
+class MockTarget:
+    """Behaviour of every virtual host.
+
+    latency          mean response delay, uniformly spread over [0, 2 * latency]
+    not_found_ratio  share of paths answered with 404, the rest are hits
+    error_rate       share of requests answered with 503
+    wildcard_hosts   how many of the first virtual hosts answer every path, in turns with a fixed page, a
+                     200 page repeating the path and a redirect to a login page which repeats it too
+    keepalive_drop   share of responses after which the server closes the connection
+    """
+
+    def __init__(self, latency=0.0, not_found_ratio=0.99, error_rate=0.0, wildcard_hosts=0, keepalive_drop=0.0,
+                 first_port=0):
+        self.latency = latency
+        self.not_found_ratio = not_found_ratio
+        self.error_rate = error_rate
+        self.wildcard_hosts = wildcard_hosts
+        self.keepalive_drop = keepalive_drop
+        self.first_port = first_port
+
+    def is_hit(self, path):
+        # Deterministic per path, so repeated runs find the same hits
+        return crc32(path.encode()) % 10000 >= self.not_found_ratio * 10000
+
+    def wildcard_kind(self, request):
+        host = request.transport.get_extra_info("sockname")[1] - self.first_port
+        return host % 3 if host < self.wildcard_hosts else None
+
+    async def handle(self, request):
+        if self.latency:
+            await asyncio.sleep(random.uniform(0, 2 * self.latency))
+        wildcard = self.wildcard_kind(request)
+        if self.error_rate and random.random() < self.error_rate:
+            response = web.Response(status=503, text="overloaded")
+        elif wildcard == 0:
+            response = web.Response(text="welcome to the front page")
+        elif wildcard == 1:
+            response = web.Response(text=f"The page {request.path} does not exist")
+        elif wildcard == 2:
+            response = web.Response(status=302, headers={"Location": "/login?next=" + quote(request.path, safe="")},
+                                    text=f"Sign in to see {request.path}")
+        elif self.is_hit(request.path):
+            response = web.Response(text=f"found {request.path}")
+        else:
+            response = web.Response(status=404, text="not found")
+        if self.keepalive_drop and random.random() < self.keepalive_drop:
+            response.force_close()
+        return response
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        return app
+
+
+async def serve(target, host, ports):
+    runner = web.AppRunner(target.make_app(), access_log=None)
+    await runner.setup()
+    for port in ports:
+        await web.TCPSite(runner, host, port, backlog=4096).start()
+    return runner
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", show_default=True)
+@click.option('--port', default=18080, show_default=True, help="First port")
+@click.option('--hosts', default=1, show_default=True, help="How many virtual hosts (consecutive ports)")
+@click.option('--latency', default=0.0, show_default=True, help="Mean response latency, seconds")
+@click.option('--not-found-ratio', default=0.99, show_default=True, help="Share of paths answered with 404")
+@click.option('--error-rate', default=0.0, show_default=True, help="Share of requests answered with 503")
+@click.option('--wildcard-hosts', default=0, show_default=True, help="How many hosts answer every path")
+@click.option('--keepalive-drop', default=0.0, show_default=True,
+              help="Share of responses followed by closing the connection")
+def main(host, port, hosts, latency, not_found_ratio, error_rate, wildcard_hosts, keepalive_drop):
+    target = MockTarget(latency, not_found_ratio, error_rate, wildcard_hosts, keepalive_drop, port)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(serve(target, host, range(port, port + hosts)))
+    click.echo(f"Serving {hosts} virtual host(s) on {host}:{port}-{port + hosts - 1}")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+"""Startup time and memory of the legacy session-per-connection layout versus SessionPool.
+
+    python3 -m bench.session_layout -m 128 -m 1024 -m 4096
+"""
+
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+from time import perf_counter
+
+import click
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from aiohttp.helpers import BasicAuth
+
+from lib.config import DEFAULT_UA
+from lib.session_pool import SessionPool
+
+LAYOUTS = ("legacy", "pooled")
+
+
+def legacy_sessions(connector, max_connections, timeout):
+    # Layout used before SessionPool: one fully configured session per connection slot
+    sessions = []
+    for _ in range(max_connections):
+        sessions.append(ClientSession(connector=connector, headers={'User-Agent': DEFAULT_UA},
+                                      timeout=ClientTimeout(total=timeout), skip_auto_headers=['Accept-Encoding'],
+                                      connector_owner=False, auth=BasicAuth(login="login", password="password")))
+    return sessions
+
+
+async def measure(layout, max_connections, pool_size):
+    connector = TCPConnector(limit=max_connections)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = perf_counter()
+    if layout == "legacy":
+        sessions = legacy_sessions(connector, max_connections, 30)
+    else:
+        sessions = SessionPool(connector, pool_size, 30).sessions
+    elapsed = perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for session in sessions:
+        await session.close()
+    await connector.close()
+    return {"sessions": len(sessions), "startup": elapsed, "rss": rss_after, "rss_delta": rss_after - rss_before}
+
+
+@click.command()
+@click.option('--max-connections', '-m', multiple=True, type=int, default=(128, 1024, 4096), show_default=True,
+              help="max_connections values to compare")
+@click.option('--pool-size', default=4, show_default=True, help="SessionPool size")
+@click.option('--run', nargs=2, type=(click.Choice(LAYOUTS), int), default=(None, None), hidden=True)
+def main(max_connections, pool_size, run):
+    if run[0]:
+        print(json.dumps(asyncio.get_event_loop().run_until_complete(measure(run[0], run[1], pool_size))))
+        return
+    click.echo(f"{'-m':>6} {'layout':>8} {'sessions':>9} {'startup':>10} {'RSS':>10} {'RSS delta':>10}")
+    for m in max_connections:
+        for layout in LAYOUTS:
+            # Every measurement runs in a fresh interpreter, so peak RSS is not shared between them
+            out = subprocess.run([sys.executable, "-m", "bench.session_layout", "--pool-size", str(pool_size),
+                                  "--run", layout, str(m)], check=True, capture_output=True, text=True).stdout
+            r = json.loads(out)
+            click.echo(f"{m:>6} {layout:>8} {r['sessions']:>9} {r['startup'] * 1000:>8.1f}ms "
+                       f"{r['rss'] / 1024:>8.1f}Mi {r['rss_delta'] / 1024:>8.1f}Mi")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+"""Local SOCKS5 stand-in for Tor: forwards CONNECT requests and records the username/password pairs it receives,
+which is what Tor's IsolateSOCKSAuth builds separate circuits from.
+
+    python3 -m bench.socks_stub --port 19050 --record auth.txt
+"""
+
+import asyncio
+import signal
+import struct
+from collections import Counter
+
+import click
+
+SOCKS_VERSION = 5
+NO_AUTH, USERNAME_PASSWORD, NO_ACCEPTABLE = 0x00, 0x02, 0xff
+ATYP_IPV4, ATYP_DOMAIN, ATYP_IPV6 = 0x01, 0x03, 0x04
+REPLY_SUCCEEDED, REPLY_REFUSED, REPLY_COMMAND_NOT_SUPPORTED = 0x00, 0x05, 0x07
+
+
+class SocksStub:
+    def __init__(self, record=None):
+        self.record = record
+        self.connections = Counter()  # (username, password) -> connections
+
+    async def authenticate(self, reader, writer):
+        _, count = await reader.readexactly(2)
+        methods = await reader.readexactly(count)
+        if USERNAME_PASSWORD in methods:
+            writer.write(bytes((SOCKS_VERSION, USERNAME_PASSWORD)))
+            await writer.drain()
+            _, length = await reader.readexactly(2)
+            username = (await reader.readexactly(length)).decode()
+            length = (await reader.readexactly(1))[0]
+            password = (await reader.readexactly(length)).decode()
+            writer.write(b"\x01\x00")
+            return username, password
+        if NO_AUTH in methods:
+            writer.write(bytes((SOCKS_VERSION, NO_AUTH)))
+            return None, None
+        writer.write(bytes((SOCKS_VERSION, NO_ACCEPTABLE)))
+        return False
+
+    @staticmethod
+    async def read_address(reader, atyp):
+        if atyp == ATYP_IPV4:
+            host = ".".join(str(b) for b in await reader.readexactly(4))
+        elif atyp == ATYP_DOMAIN:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+        else:
+            host = ":".join(f"{a:02x}{b:02x}" for a, b in zip(*[iter(await reader.readexactly(16))] * 2))
+        port, = struct.unpack(">H", await reader.readexactly(2))
+        return host, port
+
+    @staticmethod
+    def reply(writer, code):
+        writer.write(bytes((SOCKS_VERSION, code, 0, ATYP_IPV4)) + bytes(6))
+
+    @staticmethod
+    async def pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, reader, writer):
+        try:
+            credentials = await self.authenticate(reader, writer)
+            if credentials is False:
+                return
+            _, command, _, atyp = await reader.readexactly(4)
+            host, port = await self.read_address(reader, atyp)
+            if command != 1:
+                self.reply(writer, REPLY_COMMAND_NOT_SUPPORTED)
+                return
+            try:
+                upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+            except OSError:
+                self.reply(writer, REPLY_REFUSED)
+                return
+            self.record_connection(credentials)
+            self.reply(writer, REPLY_SUCCEEDED)
+            await writer.drain()
+            await asyncio.gather(self.pipe(reader, upstream_writer), self.pipe(upstream_reader, writer))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def record_connection(self, credentials):
+        if credentials not in self.connections and self.record:
+            with open(self.record, "a") as f:
+                f.write(f"{credentials[0]}\t{credentials[1]}\n")
+        self.connections[credentials] += 1
+
+    def summary(self):
+        lines = [f"{len(self.connections)} distinct auth pair(s), {sum(self.connections.values())} connection(s)"]
+        for (username, password), count in self.connections.most_common():
+            lines.append(f"  {username}:{password}  {count}")
+        return "\n".join(lines)
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", show_default=True)
+@click.option('--port', default=19050, show_default=True)
+@click.option('--record', type=click.Path(dir_okay=False), help="Append every new auth pair to this file")
+def main(host, port, record):
+    stub = SocksStub(record)
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(stub.handle, host, port, backlog=4096))
+    click.echo(f"SOCKS5 stub listening on {host}:{port}")
+    for s in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(s, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        click.echo(stub.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+from time import monotonic
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class CircuitBreaker:
+    """Stops sending requests to a failing host and lets a single probe through after a cool-down"""
+
+    def __init__(self, max_errors, cooldown, max_trips):
+        self.max_errors = max_errors
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.reopen_at = 0.0
+
+    def allow(self, in_flight):
+        if self.state == OPEN:
+            if monotonic() < self.reopen_at:
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return not in_flight  # Requests sent before the trip have to settle, then one probe goes out
+        return True
+
+    def on_success(self):
+        self.failures = 0
+        if self.state == CLOSED:
+            return False
+        self.state = CLOSED
+        self.trips = 0
+        return True
+
+    def on_failure(self):
+        self.failures += 1
+        if self.state == OPEN or (self.state == CLOSED and self.failures <= self.max_errors):
+            return False
+        self.state = OPEN
+        self.trips += 1
+        self.reopen_at = monotonic() + self.current_cooldown()
+        return True
+
+    def current_cooldown(self):
+        # Every failed probe doubles the cool-down
+        return self.cooldown * 2 ** (self.trips - 1)
+
+    def cooldown_left(self):
+        return max(self.reopen_at - monotonic(), 0.0) if self.state == OPEN else 0.0
+
+    def is_exhausted(self):
+        return self.trips >= self.max_trips
+
+    def dump(self):
+        # The cool-down left rather than the deadline, monotonic time of another machine means nothing here
+        cooldown = max(self.reopen_at - monotonic(), 0.0) if self.state != CLOSED else None
+        return {"failures": self.failures, "trips": self.trips, "cooldown": cooldown}
+
+    def load(self, state):
+        self.failures = state["failures"]
+        self.trips = state["trips"]
+        if state["cooldown"] is None:
+            self.state = CLOSED
+        else:
+            self.state = OPEN
+            self.reopen_at = monotonic() + state["cooldown"]
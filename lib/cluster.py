@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+import hmac
+import json
+import os
+import socket
+from collections import Counter, deque
+from copy import copy
+from itertools import count
+from time import monotonic
+
+from tqdm import tqdm
+
+from lib.event_loop import new_event_loop
+from lib.logger import get_logger, TqdmLoggingHandler
+from lib.response import ScanResponse
+from lib.scan_manager import ScanManager
+from lib.scan_target import ScanTarget, prepare_targets, target_count
+from lib.writer import ResultWriter
+
+STREAM_LIMIT = 1 << 24  # Longest protocol line, a chunk of the path list is the largest message
+PATHS_PER_MESSAGE = 5000
+WAIT_DELAY = 1.0  # How long a worker waits before asking again when nothing can be handed out
+STEAL_DELAY = 0.1  # The same, while the second half of a unit is being taken from its owner
+
+
+def encode(message):
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+
+async def read_message(reader):
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+
+class WorkUnit:
+    """Paths start..end of the path list, sent to a target below base (the root or a discovered directory)"""
+
+    def __init__(self, unit_id, target, base, start, end):
+        self.unit_id = unit_id
+        self.target = target
+        self.base = base
+        self.start = start
+        self.end = end
+        self.position = start  # Next path its owner is going to send, as of the last heartbeat
+        self.owner = None
+        self.expires = 0.0
+        self.splitting = False
+
+    def remaining(self):
+        return self.end - self.position
+
+    def message(self):
+        return {"op": "unit", "id": self.unit_id, "target": self.target.target_id, "url": self.target.target_url,
+                "weight": self.target.weight, "base": self.base, "start": self.start, "end": self.end,
+                "calibrated": self.target.calibrated, "wildcard": self.target.wildcard.dump(),
+                "circuit": self.target.circuit.dump()}
+
+
+class WorkerState:
+    def __init__(self, name, stream, capacity):
+        self.name = name
+        self.stream = stream
+        self.capacity = capacity
+        self.units = {}  # unit id -> leased WorkUnit
+        self.targets = Counter()  # target id -> units of it leased by this worker
+
+    def send(self, message):
+        self.stream.write(encode(message))
+
+
+class Coordinator:
+    """Owns the target list and hands the scan out to workers (--join) as work units.
+
+    A unit is a range of the path list for one target. Workers pull units over a line based JSON protocol,
+    hold at most one unit of a target at a time and renew their leases with heartbeats. Units of a worker
+    which disconnects or misses its heartbeats for lease_timeout are handed out again. A worker with nothing
+    left to do steals the second half of the largest unit in progress. Hits and discovered directories are
+    reported back, hits are merged into the target logs and outputs of the coordinator.
+
+    Only one unit of a target is handed out until the target is calibrated, its worker reports the soft-404
+    fingerprints it learned. Those, and the circuit breaker state reported with every finished unit, are sent
+    along with the later units of the target.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.paths = []
+        self.target_source = None
+        self.targets = {}  # target id -> ScanTarget with units pending or leased
+        self.outstanding = Counter()  # target id -> units pending or leased
+        self.calibrating = {}  # target id -> unit id, its owner calibrates the target
+        self.seen_hits = {}  # target id -> urls of the hits written, units handed out twice report them twice
+        self.pending = deque()
+        self.leased = {}  # unit id -> WorkUnit
+        self.unit_ids = count()
+        self.workers = set()
+        self.joined = 0
+        self.started_targets = 0
+        self.completed = 0  # Paths of the units finished or dropped
+        self.handlers = {"get": self.on_get, "progress": self.on_progress, "hit": self.on_hit, "dir": self.on_dir,
+                         "finish": self.on_finish, "split": self.on_split, "calibrated": self.on_calibrated}
+        self.loop = None
+        self.done = None
+        self.writer = None
+        self.pbar = None
+        self.logger = None
+
+    def run(self):
+        self.loop, _ = new_event_loop(self.config.event_loop)
+        self.pbar = tqdm(total=len(self.config.pathlist) * target_count(self.config), ascii=True, position=0,
+                         leave=False, dynamic_ncols=True)
+        self.logger = get_logger('COORDINATOR', 'INFO', handler=TqdmLoggingHandler(self.pbar))
+        console = get_logger('URL', 'INFO', log_format="[%(asctime)s] %(message)s",
+                             handler=TqdmLoggingHandler(self.pbar))
+        self.writer = ResultWriter(self.config, console, self.logger)
+        try:
+            self.loop.run_until_complete(self.serve())
+        except KeyboardInterrupt:
+            self.loop.run_until_complete(self.close_logs())
+            raise
+        finally:
+            self.loop.close()
+            self.pbar.close()
+
+    async def serve(self):
+        self.paths = self.config.pathlist.paths
+        self.target_source = iter(prepare_targets(self.config))
+        self.done = asyncio.Event()
+        host, port = self.config.coordinator
+        server = await asyncio.start_server(self.handle_worker, host, port, limit=STREAM_LIMIT)
+        self.logger.info(f"Waiting for workers on {host}:{port}")
+        writer = self.loop.create_task(self.writer.run())
+        leases = self.loop.create_task(self.expire_leases())
+        try:
+            self.check_done()
+            await self.done.wait()
+            # Workers asking for more are told the scan is over, they report their last progress and leave
+            deadline = monotonic() + self.config.lease_timeout
+            while self.workers and monotonic() < deadline:
+                await asyncio.sleep(0.1)
+        finally:
+            server.close()
+            leases.cancel()
+            writer.cancel()
+            await self.close_logs()
+        self.logger.info(f"{self.started_targets} targets scanned by {self.joined} workers")
+        if self.config.path_stats:
+            await self.loop.run_in_executor(None, self.config.path_stats.save)
+
+    async def close_logs(self):
+        for target in self.targets.values():
+            self.writer.close_log(target)
+        await self.writer.close()
+
+    def check_secret(self, secret):
+        # Constant time, so the secret cannot be guessed from how long a rejection takes
+        return hmac.compare_digest(str(secret).encode(), self.config.cluster_secret.encode())
+
+    async def handle_worker(self, reader, stream):
+        worker = None
+        try:
+            message = await read_message(reader)
+            if not message or message.get("op") != "hello" or not self.check_secret(message.get("secret")):
+                self.logger.warning(f"Rejected connection from {stream.get_extra_info('peername')}")
+                return
+            worker = WorkerState(message["name"], stream, message["capacity"])
+            for i in range(0, len(self.paths), PATHS_PER_MESSAGE):
+                worker.send({"op": "paths", "paths": self.paths[i:i + PATHS_PER_MESSAGE]})
+            worker.send({"op": "ready", "recursion_depth": self.config.recursion_depth})
+            self.workers.add(worker)
+            self.joined += 1
+            self.logger.info(f"Worker {worker.name} joined, {len(self.workers)} connected")
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                await self.handlers[message["op"]](worker, message)
+                await stream.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            self.logger.warning(f"Dropping worker {worker.name if worker else '?'}: {type(e).__name__} {e}")
+        finally:
+            stream.close()
+            if worker:
+                self.workers.discard(worker)
+                self.release(worker)
+
+    async def on_get(self, worker, message):
+        unit = self.next_unit(worker)
+        if unit:
+            self.lease(worker, unit)
+            worker.send(unit.message())
+        elif self.check_done():
+            worker.send({"op": "done"})
+        else:
+            worker.send({"op": "wait", "delay": STEAL_DELAY if self.steal(worker) or self.calibrating else WAIT_DELAY})
+
+    async def on_progress(self, worker, message):
+        expires = monotonic() + self.config.lease_timeout
+        for unit in worker.units.values():
+            unit.expires = expires
+        for unit_id, position in message["units"].items():
+            unit = worker.units.get(int(unit_id))
+            if unit:
+                unit.position = position
+        self.show_progress()
+
+    async def on_hit(self, worker, message):
+        target = self.targets.get(message["target"])
+        if target is None or not target.is_running():
+            return
+        response = ScanResponse(*message["hit"])
+        if response.url in self.seen_hits[target.target_id]:
+            return
+        self.seen_hits[target.target_id].add(response.url)
+        if self.config.path_stats:
+            self.config.path_stats.record_hit(response.path)
+        await self.writer.put(target, response)
+
+    async def on_dir(self, worker, message):
+        target = self.targets.get(message["target"])
+        if target is None or not target.is_running():
+            return
+        added = target.add_directory(message["dir"])
+        if added:
+            self.pbar.total += added
+            self.add_units(target, message["dir"] + '/')
+
+    async def on_finish(self, worker, message):
+        unit = worker.units.get(message["unit"])
+        if unit is None:
+            return  # Already handed out again
+        self.unlease(unit)
+        self.completed += unit.end - unit.start
+        unit.target.circuit.load(message["circuit"])
+        if self.config.path_stats:
+            for index in message["tried"]:
+                self.config.path_stats.record_try(unit.base + self.paths[index])
+        if message["blocked"]:
+            self.block_target(unit.target, worker)
+        self.unit_done(unit.target)
+        self.show_progress()
+
+    async def on_calibrated(self, worker, message):
+        target = self.targets.get(message["target"])
+        if target is None or target.calibrated or self.calibrating.get(target.target_id) not in worker.units:
+            return  # Late report of a worker whose unit was handed out again, its new owner calibrates
+        target.wildcard.load(message["wildcard"])
+        target.calibrated = True
+        self.calibrating.pop(target.target_id, None)
+        if target.wildcard:
+            self.logger.info(f"Target {target.get_target_name()} answers nonexistent paths, "
+                             f"{worker.name} learned {len(target.wildcard)} soft-404 fingerprint(s)")
+
+    async def on_split(self, worker, message):
+        unit = worker.units.get(message["unit"])
+        if unit is None:
+            return
+        unit.splitting = False
+        if message["end"] is None:
+            return
+        unit.position = message["position"]
+        if message["end"] < unit.end:
+            self.pending.appendleft(WorkUnit(next(self.unit_ids), unit.target, unit.base, message["end"], unit.end))
+            self.outstanding[unit.target.target_id] += 1
+            unit.end = message["end"]
+
+    def next_unit(self, worker):
+        if len(worker.units) >= worker.capacity:
+            return None
+        while True:
+            # A worker gets at most one unit of a target, so the per-host limits of the worker still hold
+            for unit in self.pending:
+                if not worker.targets[unit.target.target_id] and unit.target.target_id not in self.calibrating:
+                    self.pending.remove(unit)
+                    return unit
+            if not self.add_target():
+                return None
+
+    def add_target(self):
+        target = next(self.target_source, None)
+        if target is None:
+            return False
+        self.targets[target.target_id] = target
+        self.seen_hits[target.target_id] = set()
+        self.started_targets += 1
+        target.start()
+        self.add_units(target, "")
+        if not self.outstanding[target.target_id]:
+            self.close_target(target)  # Empty path list
+        return True
+
+    def add_units(self, target, base):
+        for start in range(0, len(self.paths), self.config.unit_size):
+            end = min(start + self.config.unit_size, len(self.paths))
+            self.pending.append(WorkUnit(next(self.unit_ids), target, base, start, end))
+            self.outstanding[target.target_id] += 1
+
+    def lease(self, worker, unit):
+        unit.owner = worker
+        unit.expires = monotonic() + self.config.lease_timeout
+        unit.position = unit.start
+        worker.units[unit.unit_id] = unit
+        worker.targets[unit.target.target_id] += 1
+        self.leased[unit.unit_id] = unit
+        if not unit.target.calibrated:
+            self.calibrating[unit.target.target_id] = unit.unit_id
+
+    def unlease(self, unit):
+        worker = unit.owner
+        del worker.units[unit.unit_id]
+        worker.targets[unit.target.target_id] -= 1
+        del self.leased[unit.unit_id]
+        if self.calibrating.get(unit.target.target_id) == unit.unit_id:
+            del self.calibrating[unit.target.target_id]  # Left before reporting, the next owner calibrates
+        unit.owner = None
+        unit.splitting = False
+
+    def requeue(self, unit):
+        # The unit is sent again from its start
+        self.unlease(unit)
+        self.pending.appendleft(unit)
+        self.show_progress()
+
+    def release(self, worker):
+        if worker.units:
+            self.logger.warning(f"Worker {worker.name} left, handing its {len(worker.units)} units out again")
+        for unit in list(worker.units.values()):
+            self.requeue(unit)
+
+    async def expire_leases(self):
+        while True:
+            await asyncio.sleep(1)
+            now = monotonic()
+            for unit in [unit for unit in self.leased.values() if unit.expires < now]:
+                self.logger.warning(f"Worker {unit.owner.name} missed its heartbeats, handing out its unit of "
+                                    f"{unit.target.get_target_name()} again")
+                self.requeue(unit)
+
+    def steal(self, thief):
+        # Asks the owner of the largest unit in progress to give its second half away, see on_split
+        victims = [unit for unit in self.leased.values() if unit.owner is not thief and not unit.splitting
+                   and not thief.targets[unit.target.target_id] and unit.remaining() >= 2 * self.config.split_min]
+        if not victims:
+            return False
+        unit = max(victims, key=WorkUnit.remaining)
+        unit.splitting = True
+        unit.owner.send({"op": "split", "unit": unit.unit_id})
+        return True
+
+    def block_target(self, target, worker):
+        if not target.is_running():
+            return
+        self.logger.warning(f"Worker {worker.name} gave up on target {target.get_target_name()}")
+        target.stop()
+        for unit in [unit for unit in self.pending if unit.target is target]:
+            self.pending.remove(unit)
+            self.completed += unit.end - unit.start
+            self.unit_done(target)
+
+    def show_progress(self):
+        # Units in progress count up to the path their owner is about to send, and go back to zero when requeued
+        done = self.completed + sum(unit.position - unit.start for unit in self.leased.values())
+        self.pbar.update(done - self.pbar.n)
+
+    def unit_done(self, target):
+        self.outstanding[target.target_id] -= 1
+        if not self.outstanding[target.target_id]:
+            self.close_target(target)
+        self.check_done()
+
+    def close_target(self, target):
+        del self.targets[target.target_id]
+        del self.outstanding[target.target_id]
+        del self.seen_hits[target.target_id]
+        self.calibrating.pop(target.target_id, None)
+        self.writer.close_log(target)
+
+    def check_done(self):
+        if not self.done.is_set() and not self.pending and not self.leased and not self.add_target():
+            self.done.set()
+        return self.done.is_set()
+
+
+class UnitQueue(deque):
+    """Target source of a worker: units handed out and not started yet, asks for more when found empty"""
+
+    def __init__(self, hungry):
+        super().__init__()
+        self.hungry = hungry
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self:
+            self.hungry.set()
+            raise StopIteration
+        return self.popleft()
+
+
+class UnitTarget(ScanTarget):
+    """A target as far as a single work unit goes, its hits are written by the coordinator"""
+
+    def __init__(self, unit, paths, config):
+        super().__init__(unit["id"], unit["url"], config, unit["weight"])
+        self.remote_id = unit["target"]
+        self.paths = paths
+        self.base = unit["base"]
+        self.position = unit["start"]
+        self.end = unit["end"]
+        self.calibrated = unit["calibrated"]
+        if self.calibrated:
+            self.wildcard.load(unit["wildcard"])
+        self.circuit.load(unit["circuit"])
+        self.tried = []  # Indices of the paths which got an answer, reported to the coordinator
+
+    def start(self):
+        self.started = monotonic()
+
+    def get_path_count(self):
+        return self.end - self.position
+
+    def link_generator(self):
+        prefix = self.target_url + '/' + self.base
+        while self.position < self.end:
+            index = self.position
+            self.position += 1
+            if self.running and self.within_budget():
+                self.requests += 1
+                yield self.target_id, prefix + self.paths[index], index
+            else:
+                yield self.target_id, None, index
+        self.exhausted = True
+
+    def split(self, min_size):
+        # Gives the second half of the paths not sent yet away, returns where this unit ends now
+        if self.end - self.position >= 2 * min_size:
+            self.end = self.position + (self.end - self.position) // 2
+        return self.end
+
+
+class ForwardWriter:
+    """Stands in for the ResultWriter of a worker: hits are sent to the coordinator, which writes them"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    async def put(self, target, response):
+        self.manager.tell({"op": "hit", "target": target.remote_id, "hit": list(response)})
+        await self.manager.stream.drain()
+
+    def close_log(self, target):
+        pass
+
+    async def run(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class ClusterScanManager(ScanManager):
+    """Worker of a coordinator (--join): scans the units it hands out until there is nothing left"""
+
+    def __init__(self, config):
+        config = copy(config)
+        config.url_list = []
+        config.pathlist = []  # The path list of the coordinator is used instead
+        config.journal = False
+        config.resume = None
+        config.outputs = []
+        config.path_stats = None
+        super().__init__(config, [])
+        self.hungry = asyncio.Event()
+        self.target_source = UnitQueue(self.hungry)
+        self.writer = ForwardWriter(self)
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.capacity = config.max_active_targets or config.max_connections
+        self.paths = []
+        self.units = {}  # unit id -> UnitTarget, queued or being scanned
+        self.reply = None
+        self.finished = False
+        self.reader = None
+        self.stream = None
+
+    def tell(self, message):
+        self.stream.write(encode(message))
+
+    async def join(self):
+        host, port = self.config.join
+        deadline = monotonic() + self.config.lease_timeout
+        while True:
+            try:
+                self.reader, self.stream = await asyncio.open_connection(host, port, limit=STREAM_LIMIT)
+                break
+            except OSError as e:
+                if monotonic() > deadline:
+                    self.logger.error(f"Coordinator {host}:{port} is not reachable: {e}")
+                    return False
+                await asyncio.sleep(1)
+        self.tell({"op": "hello", "name": self.name, "capacity": self.capacity, "secret": self.config.cluster_secret})
+        while True:
+            message = await read_message(self.reader)
+            if message is None:
+                self.logger.error(f"Coordinator {host}:{port} closed the connection, check the secret")
+                return False
+            if message["op"] == "ready":
+                break
+            self.paths.extend(message["paths"])
+        self.config.recursion_depth = message["recursion_depth"]
+        self.logger.info(f"Joined coordinator {host}:{port} as {self.name}, path list of {len(self.paths)} paths")
+        return True
+
+    async def run(self):
+        if not await self.join():
+            return
+        listener = self.loop.create_task(self.listen())
+        requester = self.loop.create_task(self.request_units())
+        heartbeat = self.loop.create_task(self.heartbeat())
+        try:
+            await super().run()
+        finally:
+            listener.cancel()
+            requester.cancel()
+            heartbeat.cancel()
+            if not self.stream.is_closing():
+                self.send_progress()
+                await self.stream.drain()
+                self.stream.close()
+
+    async def listen(self):
+        while True:
+            try:
+                message = await read_message(self.reader)
+            except (ConnectionError, ValueError):
+                message = None
+            if message is None:
+                self.logger.warning(f"Lost the connection to the coordinator")
+                self.finished = True
+                self.target_ready.set()
+                if self.reply and not self.reply.done():
+                    self.reply.set_result({"op": "done"})
+                return
+            if message["op"] == "split":
+                target = self.units.get(message["unit"])
+                self.tell({"op": "split", "unit": message["unit"],
+                           "end": target.split(self.config.split_min) if target else None,
+                           "position": target.position if target else None})
+            elif self.reply and not self.reply.done():
+                self.reply.set_result(message)
+
+    async def request_units(self):
+        # Only one request at a time, and only when generate_links found no unit waiting for a free slot
+        while True:
+            await self.hungry.wait()
+            self.hungry.clear()
+            self.reply = self.loop.create_future()
+            self.tell({"op": "get"})
+            message = await self.reply
+            self.reply = None
+            if message["op"] == "unit":
+                target = UnitTarget(message, self.paths, self.config)
+                self.units[target.target_id] = target
+                self.target_source.append(target)
+                self.extend_progress(target.get_path_count())
+            elif message["op"] == "wait":
+                await asyncio.sleep(message["delay"])
+                self.hungry.set()
+            else:
+                self.finished = True
+                self.target_ready.set()
+                return
+            self.target_ready.set()
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(self.config.heartbeat_interval)
+            self.send_progress()
+            await self.stream.drain()
+
+    def send_progress(self):
+        self.tell({"op": "progress", "units": {unit_id: target.position for unit_id, target in self.units.items()}})
+
+    async def generate_links(self):
+        # The scan is over when the coordinator has nothing left, not when the units at hand are done
+        while True:
+            async for link in super().generate_links():
+                yield link
+            if self.finished and not self.target_source:
+                return
+            self.target_ready.clear()
+            self.hungry.set()
+            await self.target_ready.wait()
+
+    def record_try(self, target, index, response):
+        target.tried.append(index)
+
+    async def calibrate(self, target):
+        await super().calibrate(target)
+        self.tell({"op": "calibrated", "target": target.remote_id, "wildcard": target.wildcard.dump()})
+
+    def add_directory(self, target, directory):
+        # The coordinator decides whether the directory is scanned, and by which worker
+        self.tell({"op": "dir", "target": target.remote_id, "dir": directory})
+
+    def finish_target(self, target_id):
+        target = self.targets[target_id]
+        super().finish_target(target_id)
+        del self.units[target_id]
+        self.tell({"op": "finish", "unit": target_id, "blocked": not target.is_running(),
+                   "circuit": target.circuit.dump(), "tried": target.tried})
@@ -17,12 +17,23 @@
 #  Author: Enemy Submarine
 
 
+from datetime import datetime
+from ipaddress import ip_address
 from os.path import join
+from urllib.parse import urlparse
 import click
 import sys
 import random
 
 from lib.config_parser import DefaultConfigParser
+from lib.event_loop import LOOP_BACKENDS
+from lib.journal import Journal
+from lib.proxy_pool import PROXY_SCHEMES
+from lib.raw_http import ENGINES
+from lib.sinks import SINKS
+from lib.path_stats import PathStats
+from lib.paths import PathList
+from lib.util import LineFile
 
 DEFAULT_UA = "Mozilla/5.0 (Windows NT 10.0; rv:78.0) Gecko/20100101 Firefox/78.0"
 
@@ -56,34 +67,122 @@ class Mutex(click.Option):
 
 
 class Config(object):
-    def __init__(self, script_path):
+    def __init__(self, script_path, argv=None):
         self.script_path = script_path
+        self.started = datetime.now()
+        # Worker processes scan only their own shard of the targets (or of the paths, for a single target)
+        self.shard_index = 0
+        self.shard_count = 1
+        self.shard_paths = False
+        self.live_targets = None  # target_id -> latency of the targets found alive by the preflight stage
         config = DefaultConfigParser()
         config.read_file(open(join(self.script_path, "pidrila.cfg")))
         # General section
         self.chunk_size = config.safe_getint("general", "chunk_size", 65535)
+        self.max_active_targets = config.safe_getint("general", "max_active_targets", 1024)
+        self.journal = config.safe_getboolean("general", "journal", True)
+        self.journal_flush_interval = config.safe_getint("general", "journal_flush_interval", 5)
         # self.autosave_logs = config.safe_getboolean("general", "autosave_logs", True) # To be implemented
         # Connection section
         self.follow_redirects = config.safe_getboolean("connection", "follow_redirects", False)
         self.giveup_timeout = config.safe_getint("connection", "giveup_timeout", 5)
         self.max_errors = config.safe_getint("connection", "max_errors", 5)
+        self.circuit_cooldown = config.safe_getfloat("connection", "circuit_cooldown", 10.0)
+        self.circuit_trips = config.safe_getint("connection", "circuit_trips", 2)
         self.max_retries = config.safe_getint("connection", "max_retries", 3)
+        self.session_pool_size = config.safe_getint("connection", "session_pool_size", 4)
+        self.body_limit = config.safe_getint("connection", "body_limit", 65536)
+        self.pipeline_depth = config.safe_getint("connection", "pipeline_depth", 8)
+        # Retry section
+        self.timeout_attempts = config.safe_getint("retry", "timeout_attempts", 2)
+        self.timeout_backoff = config.safe_getfloat("retry", "timeout_backoff", 5.0)
+        self.reset_backoff = config.safe_getfloat("retry", "reset_backoff", 0.25)
+        self.server_attempts = config.safe_getint("retry", "server_attempts", 3)
+        self.server_backoff = config.safe_getfloat("retry", "server_backoff", 1.0)
+        self.backoff_cap = config.safe_getfloat("retry", "backoff_cap", 60.0)
+        # Proxy section
+        self.proxy_max_errors = config.safe_getint("proxy", "max_errors", 5)
+        self.proxy_cooldown = config.safe_getfloat("proxy", "cooldown", 30.0)
+        self.proxy_trips = config.safe_getint("proxy", "trips", 5)
+        # Preflight section
+        self.preflight_timeout = config.safe_getfloat("preflight", "timeout", 10.0)
+        self.preflight_connections = max(config.safe_getint("preflight", "connections", 512), 1)
+        self.preflight_attempts = max(config.safe_getint("preflight", "attempts", 2), 1)
+        # Rate limit section
+        self.burst = config.safe_getint("rate_limit", "burst", 100)
+        self.host_burst = config.safe_getint("rate_limit", "host_burst", 5)
+        # Cluster section
+        self.unit_size = max(config.safe_getint("cluster", "unit_size", 5000), 1)
+        self.split_min = max(config.safe_getint("cluster", "split_min", 250), 1)
+        self.heartbeat_interval = config.safe_getfloat("cluster", "heartbeat_interval", 5.0)
+        self.lease_timeout = config.safe_getfloat("cluster", "lease_timeout", 30.0)
+        self.cluster_secret = config.safe_get("cluster", "secret", "")
+        # Paths section
+        self.recursion_budget = config.safe_getint("paths", "recursion_budget", 100000)
+        self.stats_file = join(self.script_path, "db", config.safe_get("paths", "stats_file", "path_stats.tsv"))
+        # Congestion section
+        self.initial_window = config.safe_getint("congestion", "initial_window", 4)
+        self.min_window = config.safe_getint("congestion", "min_window", 1)
+        self.window_decrease = config.safe_getfloat("congestion", "decrease", 0.5)
+        self.latency_factor = config.safe_getfloat("congestion", "latency_factor", 3.0)
+        # Output section
+        self.output_queue_size = config.safe_getint("output", "queue_size", 10000)
+        self.flush_size = config.safe_getint("output", "flush_size", 1000)
+        self.flush_interval = config.safe_getfloat("output", "flush_interval", 1.0)
+        self.console_rate = config.safe_getint("output", "console_rate", 20)
+        # Metrics section
+        self.metrics_interval = config.safe_getint("metrics", "interval", 10)
+        self.metrics_host = config.safe_get("metrics", "host", "127.0.0.1")
+        # Wildcard section
+        self.calibration_requests = config.safe_getint("wildcard", "calibration_requests", 3)
+        self.wildcard_length_bucket = config.safe_getint("wildcard", "length_bucket", 64)
+        self.wildcard_abort_after = config.safe_getint("wildcard", "abort_after", 100)
         # CLI args
-        arguments = self.parse_arguments(config)
+        arguments = self.parse_arguments(config, argv)
         if not arguments:
             sys.exit(0)
         self.auth = arguments['auth']
         self.logs = arguments['logs']
         self.http_method = arguments['http_method']
+        self.scheduler = arguments['scheduler']
+        self.chunk_size = arguments['chunk_size']
+        self.max_active_targets = arguments['max_active_targets']
+        self.request_budget = arguments['request_budget']
+        self.time_budget = arguments['time_budget']
+        self.calibrate = arguments['calibrate'] and self.calibration_requests > 0
+        self.resume = arguments['resume']
+        if self.resume:
+            # Logs and outputs of the interrupted scan are continued instead of starting new ones
+            self.started = Journal.started(self.resume) or self.started
+        self.preflight = arguments['preflight']
+        self.engine = arguments['engine']
+        self.rate = arguments['rate']
+        self.host_rate = arguments['host_rate']
+        self.coordinator = arguments['coordinator']
+        self.join = arguments['join']
+        self.workers = arguments['workers']
+        self.event_loop = arguments['event_loop']
+        self.outputs = arguments['output']
+        self.metrics_file = arguments['metrics_file']
+        self.metrics_port = arguments['metrics_port']
         self.max_connections = arguments['max_connections']
         self.max_connections_per_host = arguments['max_connections_per_host']
+        self.adaptive_concurrency = arguments['adaptive_concurrency']
         self.timeout = arguments['timeout']
-        self.proxy = arguments['proxy']
+        self.proxies = arguments['proxy'] + arguments['proxy_list']
+        self.isolate_targets = arguments['isolate_targets']
         self.url = arguments['url']
         self.url_list = arguments['url_list']
         if self.url_list:
             self.url_list_name = arguments['url_list_name']
         self.pathlist = arguments['pathlist']
+        self.recursion_depth = arguments['recursion_depth']
+        self.prioritize = arguments['prioritize'] or arguments['top'] > 0
+        self.top = arguments['top']
+        # Statistics are read for --prioritize even when this scan does not add to them
+        self.path_stats = PathStats(self.stats_file) if arguments['collect_stats'] else None
+        if self.prioritize:
+            self.pathlist.prioritize(PathStats(self.stats_file).scores(), self.top)
         if not arguments['user_agent']:
             if config.safe_getboolean("connection", "random_useragent", True):
                 self.user_agent = self.pick_user_agent()
@@ -92,12 +191,175 @@ class Config(object):
         else:
             self.user_agent = arguments['user_agent']
 
-    def parse_arguments(self, config):
+    def parse_arguments(self, config, argv=None):
+        @click.option(
+            '--collect-stats/--no-collect-stats',
+            default=config.safe_getboolean("paths", "collect_stats", False),
+            help="Add the hits of this scan to the path statistics used by --prioritize and --top"
+        )
+        @click.option(
+            '--host-rate',
+            type=click.FloatRange(0, None),
+            default=config.safe_getfloat("rate_limit", "host_rate", 0.0),
+            help="Requests per second sent to a single host, 0 is unlimited (burst size is host_burst in pidrila.cfg)",
+            show_default=True
+        )
+        @click.option(
+            '--rate',
+            type=click.FloatRange(0, None),
+            default=config.safe_getfloat("rate_limit", "rate", 0.0),
+            help="Requests per second of the whole scan, 0 is unlimited (burst size is burst in pidrila.cfg)",
+            show_default=True
+        )
+        @click.option(
+            '--join',
+            metavar='HOST:PORT',
+            callback=self.get_address,
+            help="Run as a worker of the coordinator at this address, it hands out the targets and paths"
+        )
+        @click.option(
+            '--coordinator',
+            metavar='HOST:PORT',
+            callback=self.get_address,
+            help="Listen on this address and hand the scan out to workers started with --join"
+        )
+        @click.option(
+            '--engine',
+            type=click.Choice(ENGINES),
+            default=config.safe_get("connection", "engine", "aiohttp", allowed=ENGINES),
+            help="HTTP client: aiohttp, or a minimal pipelining HTTP/1.1 client (raw)",
+            show_default=True
+        )
+        @click.option(
+            '--preflight/--no-preflight',
+            default=config.safe_getboolean("preflight", "enabled", True),
+            help="Probe every target of a target list once and only scan the ones which answer",
+            show_default=True
+        )
+        @click.option(
+            '--time-budget',
+            type=click.IntRange(0, None),
+            default=config.safe_getint("general", "time_budget", 0),
+            help="Stop sending new requests to a target after this many seconds (0 is unlimited)",
+            show_default=True
+        )
+        @click.option(
+            '--request-budget',
+            type=click.IntRange(0, None),
+            default=config.safe_getint("general", "request_budget", 0),
+            help="Send at most this many requests to a target (0 is unlimited)",
+            show_default=True
+        )
+        @click.option(
+            '--top',
+            type=click.IntRange(0, None),
+            default=config.safe_getint("paths", "top", 0),
+            help="Only send this many paths per target, the most likely hits first (0 sends all)",
+            show_default=True
+        )
+        @click.option(
+            '--prioritize/--file-order',
+            default=config.safe_getboolean("paths", "prioritize", False),
+            help="Send the paths found most often in previous scans first"
+        )
+        @click.option(
+            '--recursion-depth', '-R',
+            type=click.IntRange(0, None),
+            default=config.safe_getint("paths", "recursion_depth", 0),
+            help="Scan directories found as redirects or 403 again, up to this many levels deep",
+            show_default=True
+        )
+        @click.option(
+            '--case-variants/--no-case-variants',
+            default=config.safe_getboolean("paths", "case_variants", False),
+            help="Also try lower case, upper case and capitalized variants of every path"
+        )
+        @click.option(
+            '--backup-suffixes',
+            callback=self.get_list,
+            default=config.safe_get("paths", "backup_suffixes", ""),
+            help="Comma separated suffixes of backup copies tried for every file, i.e. .bak,~,.old"
+        )
+        @click.option(
+            '--extensions', '-e',
+            callback=self.get_list,
+            default=config.safe_get("paths", "extensions", "php,html,txt"),
+            help="Comma separated extensions substituted for %EXT% in the path list",
+            show_default=True
+        )
+        @click.option(
+            '--output', '-o',
+            multiple=True,
+            callback=self.get_outputs,
+            default=[x.strip() for x in config.safe_get("output", "formats", "").split(",") if x.strip()],
+            help="Also write hits as jsonl, csv or sqlite, i.e. jsonl:hits.jsonl (default path is in the logs directory)"
+        )
+        @click.option(
+            '--metrics-port',
+            type=click.IntRange(min=1, max=65535),
+            help="Serve Prometheus metrics on this port (at /metrics)"
+        )
+        @click.option(
+            '--metrics-file',
+            type=click.Path(dir_okay=False, writable=True),
+            help="Periodically write a JSON snapshot of request metrics to this file"
+        )
+        @click.option(
+            '--event-loop',
+            type=click.Choice(LOOP_BACKENDS),
+            default=config.safe_get("general", "event_loop", "auto", allowed=LOOP_BACKENDS),
+            help="Event loop backend, auto uses uvloop when it is installed",
+            show_default=True
+        )
+        @click.option(
+            '--workers', '-w',
+            type=click.IntRange(min=1),
+            default=config.safe_getint("general", "workers", 1),
+            help="How many scanner processes should we run",
+            show_default=True
+        )
+        @click.option(
+            '--resume',
+            type=click.Path(dir_okay=False),
+            help="Resume an interrupted scan from its journal file"
+        )
+        @click.option(
+            '--adaptive-concurrency/--static-concurrency',
+            default=config.safe_getboolean("congestion", "adaptive", True),
+            help="Adjust simultaneous requests per host to its latency and errors (AIMD)",
+            show_default=True
+        )
+        @click.option(
+            '--calibrate/--no-calibrate',
+            default=config.safe_getboolean("wildcard", "calibrate", True),
+            help="Fingerprint soft-404 responses of each target before the scan and drop matching hits",
+            show_default=True
+        )
+        @click.option(
+            '--max-active-targets',
+            default=self.max_active_targets,
+            help="How many targets should be scanned at the same time (0 - unlimited)",
+            show_default=True
+        )
+        @click.option(
+            '--scheduler',
+            type=click.Choice(['pipeline', 'chunked']),
+            default=config.safe_get("general", "scheduler", "pipeline", allowed=('pipeline', 'chunked')),
+            help="Request scheduler: sliding window pipeline or fixed-size chunks",
+            show_default=True
+        )
+        @click.option(
+            '--chunk-size',
+            type=click.IntRange(min=1),
+            default=self.chunk_size,
+            help="Requests group size of the chunked scheduler",
+            show_default=True
+        )
         @click.option(
             '--http-method',
-            type=click.Choice(['head', 'get']),
+            type=click.Choice(['head', 'get', 'head-get']),
             default="get",
-            help="HTTP method: GET or HEAD",
+            help="HTTP method: GET, HEAD, or HEAD first and GET only for paths not answered with 404",
             show_default=True
         )
         @click.option(
@@ -111,23 +373,37 @@ class Config(object):
             required=True,
             help="Target URL",
             cls=Mutex,
-            not_required_if=['url_list']
+            not_required_if=['url_list', 'join']
         )
         @click.option(
             '--url-list', '-L',
-            type=click.File('r'),
+            type=click.Path(exists=True, dir_okay=False, readable=True),
             help="Target URL list"
         )
         @click.option(
             '--pathlist', '-p',
-            type=click.File('r'),
+            type=click.Path(exists=True, dir_okay=False, readable=True),
             help="Path list",
             default=join(self.script_path, "db", config.safe_get("general", "pathlist", "pathlist.txt"))
         )
+        @click.option(
+            '--isolate-targets/--shared-circuits',
+            default=config.safe_getboolean("proxy", "isolate_targets", False),
+            help="Send every target through its own SOCKS credentials, so Tor builds a separate circuit for it"
+        )
+        @click.option(
+            '--proxy-list',
+            type=click.Path(exists=True, dir_okay=False, readable=True),
+            callback=self.get_proxy_list,
+            help="File with one proxy address per line, targets are spread across all of them"
+        )
         @click.option(
             '--proxy', '-p',
-            help="Proxy address, like socks5h://127.0.0.1:9050",
-            default=config.safe_get("connection", "proxy", None)
+            multiple=True,
+            callback=self.get_proxies,
+            help="Proxy address, like socks5h://127.0.0.1:9050 (socks4, socks4a, socks5, socks5h or http), "
+                 "can be repeated",
+            default=[x.strip() for x in config.safe_get("connection", "proxy", "").split(",") if x.strip()]
         )
         @click.option(
             '--max-connections', '-m',
@@ -138,7 +414,7 @@ class Config(object):
         @click.option(
             '--max-connections-per-host', '-M',
             default=config.safe_getint("connection", "max_connections_per_host", 16),
-            help="How many simultaneous connections should we open (per each host)",
+            help="How many simultaneous connections should we open (per each host, upper bound of adaptive window)",
             show_default=True
         )
         @click.option(
@@ -158,14 +434,23 @@ class Config(object):
         )
         @click.command()
         def _parse_arguments(**kwargs):
-            kwargs['pathlist'] = tuple((x.rstrip() for x in kwargs['pathlist'].readlines()))
+            if kwargs['resume'] and not Journal.files(kwargs['resume']):
+                raise click.BadParameter(f"no journal found at {kwargs['resume']}", param_hint="'--resume'")
+            coordinator = kwargs['coordinator']
+            if coordinator and not is_loopback(coordinator[0]) and not config.safe_get("cluster", "secret", ""):
+                # Anyone who can connect could join, receive the target list and feed fake hits into the logs
+                raise click.BadParameter("set secret in the [cluster] section of pidrila.cfg to listen on a "
+                                         "non-loopback address", param_hint="'--coordinator'")
+            # The target list is streamed, the path list is expanded once into memory (see PathList)
+            kwargs['pathlist'] = PathList(LineFile(kwargs['pathlist']), kwargs['extensions'],
+                                          kwargs['backup_suffixes'], kwargs['case_variants'])
             if kwargs['url_list']:
-                kwargs['url_list_name'] = kwargs['url_list'].name
-                kwargs['url_list'] = tuple((x.rstrip() for x in kwargs['url_list'].readlines()))
+                kwargs['url_list_name'] = kwargs['url_list']
+                kwargs['url_list'] = LineFile(kwargs['url_list'])
             return kwargs
 
         try:
-            return _parse_arguments(standalone_mode=False)
+            return _parse_arguments(args=argv, standalone_mode=False)
         except click.ClickException as e:
             e.show()
             sys.exit(-1)
@@ -175,7 +460,53 @@ class Config(object):
         ua = random.choice(lines)
         return ua.strip()
 
+    @staticmethod
+    def get_outputs(ctx, param, value):
+        outputs = []
+        for output in value:
+            output_format, _, path = output.partition(":")
+            if output_format not in SINKS:
+                raise click.BadParameter(f"unknown format {output_format}, use one of {', '.join(SINKS)}")
+            outputs.append((output_format, path or None))
+        return outputs
+
+    @staticmethod
+    def get_address(ctx, param, value):
+        if value is None:
+            return None
+        host, _, port = value.rpartition(":")
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            raise click.BadParameter(f"expected HOST:PORT, got {value}")
+        return host or "127.0.0.1", int(port)
+
+    @staticmethod
+    def get_list(ctx, param, value):
+        return [x.strip() for x in value.split(",") if x.strip()]
+
+    @staticmethod
+    def get_proxies(ctx, param, value):
+        for proxy in value:
+            if urlparse(proxy).scheme not in PROXY_SCHEMES:
+                raise click.BadParameter(f"unsupported proxy {proxy}, use one of {', '.join(PROXY_SCHEMES)}")
+        return list(value)
+
+    @staticmethod
+    def get_proxy_list(ctx, param, value):
+        if not value:
+            return []
+        with open(value) as f:
+            return Config.get_proxies(ctx, param, [line.strip() for line in f if line.strip()])
+
     @staticmethod
     def get_logpass(ctx, param, value):
         if value is not None and ":" in value:
             return value.split(":")
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ip_address(host).is_loopback
+    except ValueError:
+        return False
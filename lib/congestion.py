@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+from time import monotonic
+
+# Statuses meaning "slow down" rather than "not found"
+CONGESTION_STATUSES = (429, 503)
+
+
+class AimdWindow:
+    """Additive-increase/multiplicative-decrease limit of requests in flight to a single host"""
+
+    def __init__(self, initial, minimum, maximum, decrease=0.5, latency_factor=3.0, adaptive=True):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.window = float(min(max(initial, self.minimum), self.maximum)) if adaptive else float(self.maximum)
+        self.threshold = float(self.maximum)  # Slow start until the first congestion signal
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.adaptive = adaptive
+        self.min_rtt = None
+        self.srtt = None
+        self.recovery_until = 0.0
+
+    def __int__(self):
+        return int(self.window)
+
+    def available(self, in_flight):
+        return in_flight < int(self.window)
+
+    def seed(self, latency):
+        self.min_rtt = self.srtt = latency
+
+    def on_success(self, latency):
+        if not self.adaptive:
+            return
+        self.min_rtt = latency if self.min_rtt is None else min(self.min_rtt, latency)
+        self.srtt = latency if self.srtt is None else 0.875 * self.srtt + 0.125 * latency
+        if latency > self.min_rtt * self.latency_factor:
+            return  # Queueing somewhere on the path, hold the window
+        if self.window < self.threshold:
+            self.window += 1.0
+        else:
+            self.window += 1.0 / self.window  # About one more request per round trip
+        self.window = min(self.window, float(self.maximum))
+
+    def on_congestion(self):
+        if not self.adaptive:
+            return
+        now = monotonic()
+        if now < self.recovery_until:
+            return  # Requests lost in the same burst are cut only once
+        self.threshold = max(self.window * self.decrease, float(self.minimum))
+        self.window = self.threshold
+        self.recovery_until = now + (self.srtt or 0.0)
+
+
+def window_summary(windows):
+    if not windows:
+        return ""
+    if len(windows) <= 4:
+        return " ".join(f"{name}:{int(window)}" for name, window in windows)
+    sizes = [int(window) for _, window in windows]
+    return f"win {min(sizes)}/{sum(sizes) / len(sizes):.1f}/{max(sizes)}"
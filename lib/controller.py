@@ -18,10 +18,12 @@
 import asyncio
 import os
 
+from lib.cluster import ClusterScanManager, Coordinator
 from lib.logger import get_logger
+from lib.preflight import Preflight
 from lib.scan_manager import ScanManager
-from lib.scan_target import ScanTarget
-from lib.util import normalize_url
+from lib.scan_target import prepare_targets, target_count
+from lib.workers import WorkerPool
 
 MAYOR_VERSION = 0
 MINOR_VERSION = 1
@@ -42,36 +44,94 @@ class Controller(object):
 
         print(program_banner)
         self.print_config()
-        self.checker = ScanManager(self.config, self.prepare_targets())
         try:
-            self.checker.run_loop()
+            if self.config.preflight and self.config.url_list and not self.config.join:
+                Preflight(self.config).run()
+            if self.config.join:
+                self.checker = ClusterScanManager(self.config)
+                self.checker.run_loop()
+            elif self.config.coordinator:
+                Coordinator(self.config).run()
+            elif self.config.workers > 1:
+                WorkerPool(self.config).run(self.total_requests())
+            else:
+                self.checker = ScanManager(self.config, prepare_targets(self.config))
+                self.checker.run_loop()
         except (asyncio.exceptions.CancelledError, KeyboardInterrupt):
             self.logger.info(f'Scan cancelled by user')
         else:
             self.logger.info(f'Scan completed')
 
-    def prepare_targets(self):
-        if self.config.url:
-            return [ScanTarget(0, normalize_url(self.config.url), self.config)]
-        elif self.config.url_list:
-            return [ScanTarget(i, normalize_url(url), self.config) for i, url in enumerate(self.config.url_list)]
+    def total_requests(self):
+        return len(self.config.pathlist) * target_count(self.config)
 
     def print_config(self):
         self.logger.info('Initializing PIDRILA...')
         self.logger.info(f'User-Agent: {self.config.user_agent}')
-        if self.config.url:
+        if self.config.join:
+            self.logger.info(f'Worker of coordinator: {self.config.join[0]}:{self.config.join[1]}')
+        elif self.config.url:
             self.logger.info(f'Target: {self.config.url}')
         else:
             self.logger.info(f'Target list: {self.config.url_list_name} ({len(self.config.url_list)} targets total)')
         self.logger.info(f'HTTP method: {self.config.http_method}')
         self.logger.info(f'Max connections: {self.config.max_connections}')
-        self.logger.info(f'Max retries: {self.config.max_retries}')
-        self.logger.info(f'Max errors per host: {self.config.max_errors}')
-        self.logger.info(f'Word list size: {len(self.config.pathlist)}')
-        self.logger.info(f'Requests group size: {self.config.chunk_size}')
+        if self.config.workers > 1:
+            self.logger.info(f'Workers: {self.config.workers}')
+        if self.config.adaptive_concurrency:
+            self.logger.info(f'Max connections per host: {self.config.max_connections_per_host} (adaptive)')
+        else:
+            self.logger.info(f'Max connections per host: {self.config.max_connections_per_host}')
+        self.logger.info(f'Max attempts: {self.config.max_retries} on connection errors, '
+                         f'{self.config.timeout_attempts} on timeouts, {self.config.server_attempts} on 5xx')
+        self.logger.info(f'Max errors per host: {self.config.max_errors} in a row, paused for '
+                         f'{self.config.circuit_cooldown:.0f}s, given up on after {self.config.circuit_trips} pauses')
+        if self.config.coordinator:
+            self.logger.info(f'Coordinator: {self.config.coordinator[0]}:{self.config.coordinator[1]}, '
+                             f'units of {self.config.unit_size} paths, {self.config.lease_timeout:.0f}s leases')
+        if self.config.url_list and not self.config.join:
+            if self.config.preflight:
+                self.logger.info(f'Preflight: {self.config.preflight_timeout:.0f}s timeout, '
+                                 f'{self.config.preflight_connections} connections')
+            self.logger.info(f'Max active targets: {self.config.max_active_targets or "unlimited"}')
+        if self.config.rate or self.config.host_rate:
+            self.logger.info(f'Rate limit: {self.config.rate or "unlimited"} req/s (burst {self.config.burst}), '
+                             f'{self.config.host_rate or "unlimited"} req/s per host (burst {self.config.host_burst})')
+        if self.config.request_budget or self.config.time_budget:
+            self.logger.info(f'Budget per target: {self.config.request_budget or "unlimited"} requests, '
+                             f'{self.config.time_budget or "unlimited"} seconds')
+        if not self.config.join:
+            self.logger.info(f'Word list size: {len(self.config.pathlist)} paths '
+                             f'from {len(self.config.pathlist.words)} lines')
+        if self.config.top:
+            self.logger.info(f'Path order: top {self.config.top} by hit rate of previous scans')
+        elif self.config.prioritize:
+            self.logger.info(f'Path order: by hit rate of previous scans')
+        if self.config.recursion_depth:
+            self.logger.info(f'Recursion depth: {self.config.recursion_depth}, '
+                             f'up to {self.config.recursion_budget} extra requests per target')
+        self.logger.info(f'Scheduler: {self.config.scheduler}')
+        self.logger.info(f'Event loop: {self.config.event_loop}')
+        if self.config.calibrate:
+            self.logger.info(f'Wildcard calibration requests: {self.config.calibration_requests}')
+        else:
+            self.logger.info(f'Wildcard calibration: disabled')
+        if self.config.scheduler == 'chunked':
+            self.logger.info(f'Requests group size: {self.config.chunk_size}')
         if self.config.url_list:
             self.logger.info(f'Requests total: {len(self.config.pathlist) * len(self.config.url_list)}')
-        if self.config.proxy:
-            self.logger.info(f'Using socks proxy: {self.config.proxy}')
+        for output_format, path in self.config.outputs:
+            self.logger.info(f'Output: {output_format} {path or "(logs directory)"}')
+        if self.config.metrics_file:
+            self.logger.info(f'Metrics snapshots: {self.config.metrics_file}')
+        if self.config.metrics_port:
+            self.logger.info(f'Metrics endpoint: http://{self.config.metrics_host}:{self.config.metrics_port}/metrics')
+        if self.config.resume:
+            self.logger.info(f'Resuming from journal: {self.config.resume}')
+        if self.config.proxies:
+            for proxy in self.config.proxies:
+                self.logger.info(f'Using proxy: {proxy}')
+            if self.config.isolate_targets:
+                self.logger.info(f'Circuit isolation: one set of SOCKS credentials per target')
         else:
             self.logger.info(f'Proxy: none')
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+
+LOOP_BACKENDS = ("auto", "asyncio", "uvloop")
+
+
+def new_event_loop(backend="auto"):
+    """Create and install an event loop of the requested backend.
+
+    Returns the loop and the name of the backend actually used: "auto" picks uvloop when it is installed,
+    an explicit "uvloop" falls back to asyncio when it is not.
+    """
+    if backend in ("auto", "uvloop"):
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            loop = uvloop.new_event_loop()
+            asyncio.set_event_loop(loop)
+            return loop, "uvloop"
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop, "asyncio"
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+from glob import glob
+from os.path import basename, join
+
+
+class RangeSet:
+    """Sorted, merged list of half-open [start, end) ranges of path indices"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    def add(self, start, end):
+        self.ranges.append((start, end))
+
+    def normalize(self):
+        merged = []
+        for start, end in sorted(self.ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.ranges = merged
+
+    def __contains__(self, index):
+        i = bisect_right(self.ranges, (index, float("inf"))) - 1
+        return i >= 0 and self.ranges[i][0] <= index < self.ranges[i][1]
+
+    @staticmethod
+    def compress(indices):
+        ranges = []
+        for index in sorted(indices):
+            if ranges and ranges[-1][1] == index:
+                ranges[-1][1] = index + 1
+            else:
+                ranges.append([index, index + 1])
+        return ranges
+
+
+class TargetState:
+    def __init__(self):
+        self.done = RangeSet()
+        self.err_cnt = 0
+        self.blocked = False
+        self.finished = False
+
+
+class Journal:
+    """Append-only checkpoint of a scan, kept next to the logs.
+
+    Records are tab separated lines:
+        P <pathlist size>               written once per run
+        D <url> <start> <end>           path indices [start, end) are done
+        E <url> <errors>                error counter of the target
+        B <url>                         target was given up on
+        F <url>                         every path of the target is done
+    Completed requests are buffered and written in batches from a worker thread. Worker processes
+    append to their own "<journal>.<worker>" file, a resumed scan reads the journal with all of them.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.states = defaultdict(TargetState)
+        self.pathlist_size = None
+        if config.resume:
+            self.path = config.resume
+            for path in self.files(config.resume):
+                self.load(path)
+            for state in self.states.values():
+                state.done.normalize()
+        else:
+            ts = datetime.strftime(config.started, "%d-%m-%y_%H_%M")
+            name = basename(config.url_list_name) if config.url_list else "url"
+            self.path = join(config.logs, f"{ts}_{name}.journal")
+        if config.shard_count > 1:
+            self.path = f"{self.path}.{config.shard_index}"
+        self.file = open(self.path, "a")
+        self.file.write(f"P\t{len(config.pathlist)}\n")
+        self.done = defaultdict(list)
+        self.errors = {}
+        self.events = []
+        self.writing = None
+
+    @staticmethod
+    def started(path):
+        # Start time of the interrupted scan, from the journal name unless it was renamed
+        try:
+            return datetime.strptime(basename(path)[:14], "%d-%m-%y_%H_%M")
+        except ValueError:
+            return None
+
+    @staticmethod
+    def files(path):
+        return [p for p in glob(path) + glob(f"{path}.*") if p.rsplit(".", 1)[-1].isdigit() or p == path]
+
+    def load(self, path):
+        with open(path) as f:
+            for line in f:
+                record = line.rstrip("\n").split("\t")
+                kind, args = record[0], record[1:]
+                if kind == "P":
+                    self.pathlist_size = int(args[0])
+                elif kind == "D":
+                    self.states[args[0]].done.add(int(args[1]), int(args[2]))
+                elif kind == "E":
+                    self.states[args[0]].err_cnt = int(args[1])
+                elif kind == "B":
+                    self.states[args[0]].blocked = True
+                elif kind == "F":
+                    self.states[args[0]].finished = True
+
+    def summary(self):
+        finished = sum(1 for state in self.states.values() if state.finished)
+        blocked = sum(1 for state in self.states.values() if state.blocked)
+        return finished, blocked
+
+    def restore(self, target):
+        # Returns False when there is nothing left to do for the target
+        state = self.states.pop(target.target_url, None)
+        if state is None:
+            return True
+        if state.finished or state.blocked:
+            return False
+        target.err_cnt = max(target.err_cnt, state.err_cnt)
+        target.done = state.done
+        return True
+
+    def complete(self, target, index):
+        self.done[target.target_url].append(index)
+
+    def set_errors(self, target):
+        self.errors[target.target_url] = target.err_cnt
+
+    def block(self, target):
+        self.events.append(f"B\t{target.target_url}\n")
+
+    def finish(self, target):
+        self.events.append(f"F\t{target.target_url}\n")
+
+    def collect(self):
+        lines = []
+        for url, indices in self.done.items():
+            lines.extend(f"D\t{url}\t{start}\t{end}\n" for start, end in RangeSet.compress(indices))
+        lines.extend(f"E\t{url}\t{errors}\n" for url, errors in self.errors.items())
+        # Completion records go first, so a target is never marked finished before its last paths
+        lines.extend(self.events)
+        self.done = defaultdict(list)
+        self.errors = {}
+        self.events = []
+        return "".join(lines)
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    async def flush(self):
+        data = self.collect()
+        if data:
+            if self.writing:
+                await self.writing
+            self.writing = asyncio.get_event_loop().run_in_executor(None, self.write, data)
+            await self.writing
+
+    async def autoflush(self):
+        while True:
+            await asyncio.sleep(self.config.journal_flush_interval)
+            await self.flush()
+
+    async def close(self):
+        if self.file.closed:
+            return
+        if self.writing:
+            await self.writing
+        self.write(self.collect())
+        self.file.close()
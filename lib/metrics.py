@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+import json
+from bisect import bisect_left
+from collections import Counter
+from time import monotonic, time
+
+from aiohttp import TraceConfig, web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RETRY_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield le, total
+
+    def to_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "buckets": {("+Inf" if le == float("inf") else str(le)): n for le, n in self.cumulative()}}
+
+
+class RequestMetrics:
+    """Histograms of one target, or of the whole scan"""
+
+    def __init__(self):
+        self.dns = Histogram(LATENCY_BUCKETS)
+        self.connect = Histogram(LATENCY_BUCKETS)
+        self.ttfb = Histogram(LATENCY_BUCKETS)
+        self.total = Histogram(LATENCY_BUCKETS)
+        self.retries = Histogram(RETRY_BUCKETS)
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.connections = Counter()  # Opened and reused connections
+
+    def histograms(self):
+        return {"dns_seconds": self.dns, "connect_seconds": self.connect, "ttfb_seconds": self.ttfb,
+                "total_seconds": self.total, "retries": self.retries}
+
+    def to_dict(self):
+        result = {name: histogram.to_dict() for name, histogram in self.histograms().items()}
+        result["statuses"] = {str(status): n for status, n in self.statuses.items()}
+        result["errors"] = dict(self.errors)
+        result["connections"] = dict(self.connections)
+        return result
+
+
+class Metrics:
+    """Per-target and global request metrics, fed by aiohttp trace hooks and ScanManager.fetch.
+
+    The per-target part only covers active targets, finished ones are folded into the global metrics.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.started = monotonic()
+        self.scan = RequestMetrics()
+        self.targets = {}
+
+    def get(self, target):
+        name = target.get_target_name()
+        if name not in self.targets:
+            self.targets[name] = RequestMetrics()
+        return self.targets[name]
+
+    def drop(self, target):
+        self.targets.pop(target.get_target_name(), None)
+
+    def observe(self, target_metrics, attribute, value):
+        getattr(self.scan, attribute).observe(value)
+        getattr(target_metrics, attribute).observe(value)
+
+    def observe_request(self, target_metrics, total, result):
+        # Every attempt counts, retries included
+        self.observe(target_metrics, "total", total)
+        if isinstance(result, Exception):
+            for metrics in (self.scan, target_metrics):
+                metrics.errors[type(result).__name__] += 1
+        else:
+            for metrics in (self.scan, target_metrics):
+                metrics.statuses[result.status] += 1
+
+    def observe_retries(self, target, retries):
+        # Once per request, with the attempt its final result came from
+        self.observe(self.get(target), "retries", retries)
+
+    def count_connection(self, target_metrics, state):
+        self.scan.connections[state] += 1
+        target_metrics.connections[state] += 1
+
+    def trace_config(self):
+        trace_config = TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.started = monotonic()
+
+        async def on_dns_resolvehost_start(session, ctx, params):
+            ctx.dns_started = monotonic()
+
+        async def on_dns_resolvehost_end(session, ctx, params):
+            if ctx.trace_request_ctx:
+                self.observe(ctx.trace_request_ctx, "dns", monotonic() - ctx.dns_started)
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connect_started = monotonic()
+
+        async def on_connection_create_end(session, ctx, params):
+            # With a proxy connector this includes the SOCKS handshake
+            if ctx.trace_request_ctx:
+                self.observe(ctx.trace_request_ctx, "connect", monotonic() - ctx.connect_started)
+                self.count_connection(ctx.trace_request_ctx, "opened")
+
+        async def on_connection_reuseconn(session, ctx, params):
+            if ctx.trace_request_ctx:
+                self.count_connection(ctx.trace_request_ctx, "reused")
+
+        async def on_request_end(session, ctx, params):
+            # Sent as soon as the status line and headers are parsed
+            if ctx.trace_request_ctx:
+                self.observe(ctx.trace_request_ctx, "ttfb", monotonic() - ctx.started)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def snapshot(self):
+        return {"timestamp": time(), "uptime": monotonic() - self.started, "scan": self.scan.to_dict(),
+                "targets": {name: metrics.to_dict() for name, metrics in self.targets.items()}}
+
+    def prometheus(self):
+        lines = []
+        per_target = [("", self.scan)] + [(f'target="{name}"', metrics) for name, metrics in self.targets.items()]
+        for name in self.scan.histograms():
+            lines.append(f"# TYPE pidrila_{name} histogram")
+            for labels, metrics in per_target:
+                histogram = metrics.histograms()[name]
+                sep = "," if labels else ""
+                for le, count in histogram.cumulative():
+                    le = "+Inf" if le == float("inf") else le
+                    lines.append(f'pidrila_{name}_bucket{{{labels}{sep}le="{le}"}} {count}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"pidrila_{name}_sum{suffix} {histogram.sum}")
+                lines.append(f"pidrila_{name}_count{suffix} {histogram.count}")
+        for metric, label, attribute in (("responses_total", "status", "statuses"), ("errors_total", "error", "errors"),
+                                         ("connections_total", "state", "connections")):
+            lines.append(f"# TYPE pidrila_{metric} counter")
+            for labels, metrics in per_target:
+                sep = "," if labels else ""
+                for key, n in getattr(metrics, attribute).items():
+                    lines.append(f'pidrila_{metric}{{{labels}{sep}{label}="{key}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, data):
+        with open(self.config.metrics_file, "w") as f:
+            f.write(data)
+
+    async def dump(self):
+        data = json.dumps(self.snapshot())
+        await asyncio.get_event_loop().run_in_executor(None, self.write_snapshot, data)
+
+    async def autodump(self):
+        while True:
+            await asyncio.sleep(self.config.metrics_interval)
+            await self.dump()
+
+    async def start_server(self):
+        async def handle(request):
+            return web.Response(text=self.prometheus(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.config.metrics_host, self.config.metrics_port).start()
+        return runner
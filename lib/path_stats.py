@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import fcntl
+import os
+from collections import Counter
+
+
+class PathStats:
+    """Hits and tries of every path across scans, kept in a small tab separated file.
+
+    Only the changes of the current scan are kept in memory, they are merged into the file under an
+    exclusive lock, so several workers or scans can share it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = Counter()
+        self.tries = Counter()
+
+    def load(self):
+        stats = {}
+        if not os.path.exists(self.path):
+            return stats
+        with open(self.path, errors="replace") as f:
+            for line in f:
+                try:
+                    path, hits, tries = line.rstrip("\n").rsplit("\t", 2)
+                    stats[path] = (int(hits), int(tries))
+                except ValueError:
+                    continue
+        return stats
+
+    def scores(self):
+        # Hit likelihood with add-one smoothing, only for paths that were ever found
+        return {path: (hits + 1) / (tries + 2) for path, (hits, tries) in self.load().items() if hits}
+
+    def record_hit(self, path):
+        self.hits[path] += 1
+
+    def record_try(self, path):
+        self.tries[path] += 1
+
+    def save(self):
+        if not self.hits and not self.tries:
+            return
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            stats = self.load()
+            for path in self.hits.keys() | self.tries.keys():
+                hits, tries = stats.get(path, (0, 0))
+                stats[path] = (hits + self.hits[path], tries + self.tries[path])
+            f.seek(0)
+            f.truncate()
+            f.writelines(f"{path}\t{hits}\t{tries}\n" for path, (hits, tries) in stats.items())
+            f.flush()
+        self.hits.clear()
+        self.tries.clear()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+from itertools import chain, islice
+from urllib.parse import urlparse
+
+EXT_MARKER = "%EXT%"
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class PathList:
+    """Word list with its templates expanded once, shared by every target.
+
+    %EXT% is replaced with every extension, files also get every backup suffix and, optionally, lower case,
+    upper case and capitalized variants. A path produced more than once, e.g. by "admin.%EXT%" and a literal
+    "admin.php", is only sent once, where it first appears.
+
+    The expansion is not lazy: the word list file is read a single time and the expanded paths are held in
+    memory as one tuple that every target indexes into. Expanding on the fly kept the file open in every
+    suspended link generator, one descriptor per active target, and could not drop duplicates across words.
+    The cost is memory proportional to the expanded list, a few MB for the shipped one, more with many
+    extensions and case variants.
+
+    When prioritized, paths with a score (see PathStats) come first, best first, and the list may be cut
+    to its top entries.
+    """
+
+    def __init__(self, words, extensions=(), backup_suffixes=(), case_variants=False):
+        self.words = words
+        self.name = words.name
+        self.extensions = extensions
+        self.backup_suffixes = backup_suffixes
+        self.case_variants = case_variants
+        self.scores = {}
+        self.top = 0
+        self._paths = None
+
+    def prioritize(self, scores, top=0):
+        self.scores = scores
+        self.top = top
+        self._paths = None
+
+    def expand(self, word):
+        if EXT_MARKER in word:
+            paths = [word.replace(EXT_MARKER, extension) for extension in self.extensions]
+        else:
+            paths = [word]
+        if self.backup_suffixes:
+            paths += [path + suffix for path in list(paths) if is_file(path) for suffix in self.backup_suffixes]
+        if self.case_variants:
+            paths += [variant for path in list(paths) for variant in (path.lower(), path.upper(), path.capitalize())]
+        return paths
+
+    def expanded(self):
+        for word in self.words:
+            yield from self.expand(word)
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            paths = tuple(dict.fromkeys(self.expanded()))  # Unique across the whole list, in order
+            if self.scores or self.top:
+                first = sorted(dict.fromkeys(path for path in paths if path in self.scores),
+                               key=lambda path: -self.scores[path])
+                taken = set(first)
+                paths = tuple(islice(chain(first, (path for path in paths if path not in taken)), self.top or None))
+            self._paths = paths
+        return self._paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.paths[index]
+
+
+def is_file(path):
+    return "." in path.rsplit("/", 1)[-1].lstrip(".")
+
+
+def discovered_directory(response):
+    # Directories show up as a redirect to the same path with a trailing slash, or as a forbidden listing
+    path = response.path.split("?", 1)[0].strip("/")
+    if not path:
+        return None
+    if response.status in REDIRECT_STATUSES and response.location:
+        location = urlparse(response.location).path
+        return path if location.endswith("/" + path + "/") else None
+    if response.status == 403 and (response.path.endswith("/") or not is_file(path)):
+        return path
+    return None
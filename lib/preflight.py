@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+import asyncio
+from collections import Counter
+from copy import copy
+from datetime import datetime
+from os.path import basename, join, splitext
+from statistics import median
+from time import monotonic
+
+from aiohttp import ClientTimeout
+from tqdm import tqdm
+
+from lib.event_loop import new_event_loop
+from lib.logger import get_logger, TqdmLoggingHandler
+from lib.proxy_pool import ProxyPool
+from lib.scan_target import parse_target
+
+
+class Preflight:
+    """Sends one cheap request to the root of every target before the scan.
+
+    Any HTTP answer, whatever its status, counts as alive. Live targets are written to a target list in the
+    logs directory and handed to the scan through config.live_targets together with their latency.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        # The probes get their own, wider connection limit, the scan limits are restored afterwards
+        probe_config = copy(config)
+        probe_config.max_connections = config.preflight_connections
+        probe_config.isolate_targets = False
+        probe_config.engine = "aiohttp"
+        self.probe_config = probe_config
+        self.timeout = ClientTimeout(total=config.preflight_timeout)
+        self.live = {}  # target_id -> latency
+        self.errors = Counter()
+        self.pbar = None
+        self.logger = None
+
+    def run(self):
+        loop, _ = new_event_loop(self.config.event_loop)
+        self.pbar = tqdm(total=len(self.config.url_list), ascii=True, position=0, leave=False, dynamic_ncols=True)
+        self.logger = get_logger('PREFLIGHT', 'INFO', handler=TqdmLoggingHandler(self.pbar))
+        try:
+            loop.run_until_complete(self.probe_all())
+        finally:
+            loop.close()
+            self.pbar.close()
+        self.config.live_targets = self.live
+        self.report()
+        return self.live
+
+    async def probe_all(self):
+        proxies = ProxyPool(self.probe_config)
+        pending = set()
+        try:
+            for target_id, line in enumerate(self.config.url_list):
+                if len(pending) >= self.config.preflight_connections:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(asyncio.ensure_future(self.probe(proxies, parse_target(target_id, line, self.config))))
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            await proxies.close()
+        with open(self.live_list_path(), "w") as f:
+            for target_id, line in enumerate(self.config.url_list):
+                if target_id in self.live:
+                    target = parse_target(target_id, line, self.config)
+                    # The third column is ignored when the file is read back with -L
+                    f.write(f"{target.target_url} {target.weight:g} {self.live[target_id]:.3f}\n")
+
+    async def probe(self, proxies, target):
+        for attempt in range(self.config.preflight_attempts):
+            session, proxy = proxies.route(target)
+            started = monotonic()
+            try:
+                async with session.head(target.target_url + '/', ssl=False, allow_redirects=False,
+                                        headers=target.headers, auth=target.auth, proxy=proxy.request_proxy,
+                                        timeout=self.timeout):
+                    self.live[target.target_id] = monotonic() - started
+                    break
+            except Exception as e:
+                if attempt + 1 == self.config.preflight_attempts:
+                    self.errors[type(e).__name__] += 1
+        proxies.release(target)
+        self.pbar.update()
+
+    def live_list_path(self):
+        ts = datetime.strftime(self.config.started, "%d-%m-%y_%H_%M")
+        name = splitext(basename(self.config.url_list_name))[0]
+        return join(self.config.logs, f"{ts}_{name}.live.txt")
+
+    def report(self):
+        total = len(self.config.url_list)
+        self.logger.info(f"{len(self.live)} of {total} targets are reachable, live list: {self.live_list_path()}")
+        if self.errors:
+            self.logger.info("Unreachable: " + ", ".join(f"{name} {cnt}" for name, cnt in self.errors.most_common()))
+        if self.live:
+            latencies = sorted(self.live.values())
+            p90 = latencies[min(int(len(latencies) * 0.9), len(latencies) - 1)]
+            self.logger.info(f"Baseline latency: min {latencies[0]:.3f}s, median {median(latencies):.3f}s, "
+                             f"p90 {p90:.3f}s, max {latencies[-1]:.3f}s")
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+from collections import Counter
+from functools import partial
+from hashlib import sha1
+from urllib.parse import urlparse
+
+from aiohttp import TCPConnector, TraceConfig, ClientProxyConnectionError
+from aiohttp_socks import ProxyConnector, ProxyConnectionError, ProxyType
+
+from lib.circuit import CircuitBreaker
+from lib.raw_http import RawClient
+from lib.session_pool import SessionPool
+
+# Scheme: (SOCKS scheme understood by aiohttp_socks, resolve names on the proxy side)
+SOCKS_SCHEMES = {
+    "socks4": ("socks4", False),
+    "socks4a": ("socks4", True),
+    "socks5": ("socks5", False),
+    "socks5h": ("socks5", True),
+}
+PROXY_SCHEMES = tuple(SOCKS_SCHEMES) + ("http",)
+
+
+def is_proxy_error(error):
+    # Only failures to reach the proxy itself, an unreachable target behind a working proxy is the target's problem
+    return isinstance(error, (ProxyConnectionError, ClientProxyConnectionError))
+
+
+def isolation_credentials(config, target):
+    # Tor (IsolateSOCKSAuth is on by default) never shares a circuit between streams with different credentials.
+    # SOCKS4 only has a user id, so the token goes into the username as well
+    token = sha1(f"{config.started.isoformat()}/{target.target_url}".encode()).hexdigest()[:16]
+    return f"pidrila-{token}", token
+
+
+class IsolatedPool:
+    """Connector of a single target with its own SOCKS credentials, and so its own Tor circuit"""
+
+    def __init__(self, proxy, target, trace_configs=None):
+        self.stats = Counter()
+        trace_config = TraceConfig()
+        trace_config.on_connection_create_end.append(self.on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self.on_connection_reuseconn)
+        config = proxy.config
+        self.connector = proxy.make_connector(*isolation_credentials(config, target),
+                                              limit=config.max_connections_per_host)
+        self.sessions = SessionPool(self.connector, 1, config.timeout, (trace_configs or []) + [trace_config])
+
+    async def on_connection_create_end(self, session, ctx, params):
+        self.stats["connections"] += 1
+
+    async def on_connection_reuseconn(self, session, ctx, params):
+        self.stats["reused"] += 1
+
+    async def close(self):
+        await self.sessions.close()
+        await self.connector.close()
+
+
+class Proxy:
+    def __init__(self, url, config, trace_configs=None):
+        self.url = url
+        self.config = config
+        self.trace_configs = trace_configs
+        self.name = urlparse(url).netloc if url else "direct"
+        self.scheme = urlparse(url).scheme if url else None
+        self.request_proxy = None if self.scheme in SOCKS_SCHEMES else url
+        self.connector = self.make_connector(limit=config.max_connections)
+        self.sessions = SessionPool(self.connector, config.session_pool_size, config.timeout, trace_configs)
+        self.circuit = CircuitBreaker(config.proxy_max_errors, config.proxy_cooldown, config.proxy_trips)
+        self.isolate = config.isolate_targets and self.scheme in SOCKS_SCHEMES
+        self.pools = {}  # target_id -> IsolatedPool
+        self.raw = self.make_raw_client() if config.engine == "raw" else None
+        self.isolated = Counter()
+        self.targets = 0
+        self.requests = 0
+
+    def make_connector(self, username=None, password=None, limit=None):
+        limits = dict(limit=limit, limit_per_host=self.config.max_connections_per_host)
+        if self.scheme in SOCKS_SCHEMES:
+            socks_scheme, rdns = SOCKS_SCHEMES[self.scheme]
+            url = socks_scheme + self.url[len(self.scheme):]
+            if username is None:
+                return ProxyConnector.from_url(url, rdns=rdns, **limits)
+            address = urlparse(url)
+            return ProxyConnector(ProxyType.SOCKS4 if socks_scheme == "socks4" else ProxyType.SOCKS5,
+                                  address.hostname, address.port, username, password, rdns=rdns, **limits)
+        # HTTP proxies are spoken to by aiohttp itself, it sends absolute URIs instead of tunneling
+        return TCPConnector(ttl_dns_cache=300, **limits)
+
+    def make_raw_client(self):
+        socks = http_proxy = None
+        address = urlparse(self.url) if self.url else None
+        if self.scheme in SOCKS_SCHEMES:
+            socks_scheme, rdns = SOCKS_SCHEMES[self.scheme]
+            socks = (ProxyType.SOCKS4 if socks_scheme == "socks4" else ProxyType.SOCKS5,
+                     address.hostname, address.port or 1080, rdns)
+        elif self.scheme:
+            http_proxy = (address.hostname, address.port or 8080)
+        credentials = partial(isolation_credentials, self.config) if self.isolate else None
+        return RawClient(self.config, socks, http_proxy, credentials)
+
+    def session(self, target):
+        if self.raw and self.raw.handles(target):
+            return None  # The request goes through the raw engine, see ScanManager.send
+        if not self.isolate:
+            return self.sessions.get(target.target_id)
+        pool = self.pools.get(target.target_id)
+        if pool is None:
+            pool = self.pools[target.target_id] = IsolatedPool(self, target, self.trace_configs)
+            self.isolated["pools"] += 1
+        return pool.sessions.get(0)
+
+    def release(self, target):
+        self.targets -= 1
+        raw_pool = self.raw.release(target.target_id) if self.raw else None
+        if raw_pool and self.isolate:
+            self.isolated["pools"] += 1
+            self.isolated.update(raw_pool.stats)
+        pool = self.pools.pop(target.target_id, None)
+        if pool is None:
+            return None
+        self.isolated.update(pool.stats)
+        return pool
+
+    def is_available(self):
+        return not self.circuit.is_exhausted() and self.circuit.allow(0)
+
+    async def close(self):
+        if self.raw:
+            self.raw.close()
+        for pool in self.pools.values():
+            await pool.close()
+        await self.sessions.close()
+        await self.connector.close()
+
+
+class ProxyPool:
+    """Connectors for the direct connection or every configured proxy, targets are pinned to one of them.
+
+    Proxies failing proxy_max_errors times in a row are taken out of rotation and tried again after a
+    cool-down, their targets move to the least loaded healthy proxy.
+    """
+
+    def __init__(self, config, trace_configs=None):
+        self.proxies = [Proxy(url, config, trace_configs) for url in config.proxies or [None]]
+        self.closing = set()
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def assign(self, target):
+        available = [proxy for proxy in self.proxies if proxy.is_available()] or self.proxies
+        proxy = min(available, key=lambda p: p.targets)
+        proxy.targets += 1
+        target.proxy = proxy
+        return proxy
+
+    def release(self, target):
+        if not target.proxy:
+            return
+        pool = target.proxy.release(target)
+        target.proxy = None
+        if pool:
+            task = asyncio.ensure_future(pool.close())
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
+
+    def route(self, target):
+        proxy = target.proxy
+        if proxy is None or (not proxy.is_available() and len(self.proxies) > 1):
+            self.release(target)
+            proxy = self.assign(target)
+        return proxy.session(target), proxy
+
+    def on_result(self, proxy, result):
+        proxy.requests += 1
+        if is_proxy_error(result):
+            return proxy.circuit.on_failure()
+        if not isinstance(result, Exception):
+            proxy.circuit.on_success()
+        return False
+
+    def is_isolated(self):
+        return any(proxy.isolate for proxy in self.proxies)
+
+    def summary(self):
+        lines = []
+        for proxy in self.proxies:
+            line = f"{proxy.name}: {proxy.requests} requests, {proxy.circuit.state}"
+            if proxy.isolate:
+                for pool in proxy.pools.values():
+                    proxy.isolated.update(pool.stats)
+                    pool.stats.clear()
+                pools, connections, reused = (proxy.isolated[key] for key in ("pools", "connections", "reused"))
+                line += (f", {pools} isolated pools, {connections} connections "
+                         f"({connections / max(pools, 1):.1f} per pool), {reused} reused")
+            lines.append(line)
+        return "; ".join(lines)
+
+    async def close(self):
+        if self.closing:
+            await asyncio.gather(*self.closing, return_exceptions=True)
+        for proxy in self.proxies:
+            await proxy.close()
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+import asyncio
+import ssl
+from collections import Counter, deque
+from functools import partial
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlsplit
+
+from aiohttp import client_exceptions
+from python_socks import ProxyConnectionError, ProxyError, ProxyTimeoutError
+from python_socks.async_.asyncio import Proxy as SocksProxy
+
+from lib.response import body_digest
+
+ENGINES = ("aiohttp", "raw")
+
+# Parser states
+HEAD, BODY, CHUNK_SIZE, CHUNK_DATA, CHUNK_END, TRAILER, UNTIL_CLOSE = range(7)
+
+MAX_HEAD_SIZE = 65536
+NO_BODY_STATUSES = (204, 304)
+SAFE_CHARS = "/%:@!$&'()*+,;=?~"
+
+
+class RawResponse:
+    __slots__ = ("url", "status", "content_length", "location", "cookies", "digest", "size", "keep_alive")
+
+    def __init__(self, url, status, content_length, location, cookies, keep_alive):
+        self.url = url
+        self.status = status
+        self.content_length = content_length
+        self.location = location
+        self.cookies = cookies
+        self.digest = None
+        self.size = 0
+        self.keep_alive = keep_alive
+
+
+class RawRequest:
+    __slots__ = ("method", "url", "path", "data", "read_body", "future", "resent")
+
+    def __init__(self, method, url, path, data, read_body):
+        self.method = method
+        self.url = url
+        self.path = path
+        self.data = data
+        self.read_body = read_body
+        self.future = None
+        self.resent = False
+
+
+class Resend(Exception):
+    """The connection was closed before the request was answered, it is safe to send it again"""
+
+
+class HttpConnection(asyncio.Protocol):
+    """A single keep-alive connection. Requests are written as soon as they are queued, responses come back
+    in the same order and only the status line, framing headers, Location and Set-Cookie are looked at.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.transport = None
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.state = HEAD
+        self.remaining = 0
+        self.response = None
+        self.body = None  # Start of the body, kept for hashing when the request asked for it
+        self.keep_alive = True
+        self.closed = False
+        self.served = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self.state == UNTIL_CLOSE:
+            self.finish()
+        self.pool.connection_lost(self, receiving=self.state != HEAD or bool(self.buffer))
+
+    def is_usable(self):
+        return self.keep_alive and not self.closed and not self.transport.is_closing()
+
+    def send(self, request):
+        self.pending.append(request)
+        self.transport.write(request.data)
+
+    def abort(self):
+        if not self.closed:
+            self.transport.abort()
+
+    def data_received(self, data):
+        self.buffer += data
+        try:
+            self.parse()
+        except (ValueError, IndexError) as e:
+            # Nothing after a malformed response can be trusted, the connection goes away with it
+            if self.pending and not self.pending[0].future.done():
+                self.pending[0].future.set_exception(client_exceptions.ClientPayloadError(f"Bad response: {e}"))
+                self.pending.popleft()
+            self.state = HEAD
+            self.buffer.clear()
+            self.abort()
+
+    def parse(self):
+        buffer = self.buffer
+        while buffer:
+            if self.state == HEAD:
+                end = buffer.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(buffer) > MAX_HEAD_SIZE:
+                        raise ValueError("response head too long")
+                    return
+                head = bytes(buffer[:end])
+                del buffer[:end + 4]
+                self.start_response(head)
+            elif self.state == BODY or self.state == CHUNK_DATA:
+                size = min(self.remaining, len(buffer))
+                if self.body is not None:
+                    self.feed(buffer[:size])
+                del buffer[:size]
+                self.remaining -= size
+                if self.remaining:
+                    return
+                if self.state == BODY:
+                    self.finish()
+                else:
+                    self.state = CHUNK_END
+            elif self.state == CHUNK_SIZE or self.state == TRAILER:
+                end = buffer.find(b"\r\n")
+                if end < 0:
+                    if len(buffer) > MAX_HEAD_SIZE:
+                        raise ValueError("chunk header too long")
+                    return
+                line = bytes(buffer[:end])
+                del buffer[:end + 2]
+                if self.state == TRAILER:
+                    if not line:
+                        self.finish()
+                    continue
+                self.remaining = int(line.split(b";", 1)[0], 16)
+                self.state = CHUNK_DATA if self.remaining else TRAILER
+            elif self.state == CHUNK_END:
+                if len(buffer) < 2:
+                    return
+                del buffer[:2]
+                self.state = CHUNK_SIZE
+            else:  # UNTIL_CLOSE
+                if self.body is not None:
+                    self.feed(buffer)
+                buffer.clear()
+
+    def start_response(self, head):
+        if not self.pending:
+            raise ValueError("response without a request")
+        lines = head.split(b"\r\n")
+        version, _, status = lines[0].partition(b" ")
+        status = int(status[:3])
+        if 100 <= status < 200:
+            return  # Interim response, the real one follows
+        length = location = cookies = connection = None
+        chunked = False
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"location":
+                location = value.strip().decode("latin-1")
+            elif name == b"transfer-encoding":
+                chunked = b"chunked" in value.lower()
+            elif name == b"connection":
+                connection = value.strip().lower()
+            elif name == b"set-cookie":
+                if cookies is None:
+                    cookies = SimpleCookie()
+                try:
+                    cookies.load(value.strip().decode("latin-1"))
+                except Exception:
+                    pass
+        if version == b"HTTP/1.1":
+            keep_alive = connection != b"close"
+        else:
+            keep_alive = connection == b"keep-alive"
+            self.pool.pipelining = False
+        request = self.pending[0]
+        self.response = RawResponse(request.url, status, length, location, cookies, keep_alive)
+        self.body = bytearray() if request.read_body and status != 404 else None
+        if request.method == "HEAD" or status in NO_BODY_STATUSES:
+            self.finish()
+        elif chunked:
+            self.state = CHUNK_SIZE
+        elif length is not None:
+            self.state = BODY
+            self.remaining = length
+            if not length:
+                self.finish()
+        else:
+            self.state = UNTIL_CLOSE
+            self.response.keep_alive = False
+
+    def feed(self, data):
+        room = self.pool.client.body_limit - self.response.size
+        if room > 0:
+            data = data[:room]
+            self.body += data
+            self.response.size += len(data)
+
+    def finish(self):
+        response = self.response
+        request = self.pending.popleft()
+        if response.size:
+            response.digest = body_digest(self.body, request.path)
+        if response.content_length is None:
+            response.content_length = response.size
+        self.response = self.body = None
+        self.state = HEAD
+        self.served += 1
+        if not request.future.done():
+            request.future.set_result(response)
+        if not response.keep_alive:
+            self.keep_alive = False
+            self.transport.close()
+        elif self.pool.pipelining is None:
+            self.pool.pipelining = True
+        self.pool.wake()
+
+
+class RawPool:
+    """Connections of one target. Requests are pipelined once the host has answered over a persistent HTTP/1.1
+    connection, a host dropping pipelined requests is only sent one request per connection from then on.
+    """
+
+    def __init__(self, client, target, credentials):
+        self.client = client
+        self.connections = []
+        self.opening = 0
+        self.waiters = deque()
+        self.pipelining = None  # Unknown until the first persistent response
+        self.stats = Counter()
+        parts = urlsplit(target.target_url)
+        self.target_url = target.target_url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = client.ssl_context if parts.scheme == "https" else None
+        self.base_path = parts.path.rstrip("/")
+        # HTTP proxies get the absolute URI, the request goes over a plain connection to the proxy itself
+        self.prefix = f"http://{parts.netloc}" if client.http_proxy else ""
+        self.socks = None
+        if client.socks:
+            proxy_type, host, port, rdns = client.socks
+            username, password = credentials or (None, None)
+            self.socks = SocksProxy(proxy_type, host, port, username, password, rdns)
+        headers = [f"Host: {parts.netloc}"] + [f"{name}: {value}" for name, value in target.headers.items()]
+        headers.append("Accept: */*")
+        if target.auth:
+            headers.append(f"Authorization: {target.auth.encode()}")
+        self.head = "\r\n".join(headers) + "\r\n"
+
+    def build(self, method, url, target, read_body):
+        path = quote(self.base_path + url[len(self.target_url):], safe=SAFE_CHARS) or "/"
+        data = f"{method} {self.prefix}{path} HTTP/1.1\r\n{self.head}"
+        if target.cookies:
+            data += "Cookie: " + "; ".join(f"{name}={value}" for name, value in target.cookies.items()) + "\r\n"
+        return RawRequest(method, url, target.get_path(url), (data + "\r\n").encode("latin-1", "replace"), read_body)
+
+    def pick(self):
+        depth = self.client.depth if self.pipelining else 1
+        best = None
+        for connection in self.connections:
+            if connection.is_usable() and len(connection.pending) < depth:
+                if best is None or len(connection.pending) < len(best.pending):
+                    best = connection
+        return best
+
+    async def acquire(self):
+        while True:
+            connection = self.pick()
+            if connection is not None and (not connection.pending or self.pipelining):
+                return connection
+            if len(self.connections) + self.opening < self.client.limit:
+                return await self.connect()
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.wake()  # Pass the free slot on
+                raise
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        factory = partial(HttpConnection, self)
+        server_hostname = self.host if self.ssl else None
+        self.opening += 1
+        try:
+            if self.socks:
+                sock = await self.socks.connect(self.host, self.port, timeout=self.client.timeout)
+                _, connection = await loop.create_connection(factory, sock=sock, ssl=self.ssl,
+                                                             server_hostname=server_hostname)
+            else:
+                host, port = self.client.http_proxy or (self.host, self.port)
+                _, connection = await loop.create_connection(factory, host, port, ssl=self.ssl,
+                                                             server_hostname=server_hostname)
+        except (ProxyConnectionError, ProxyError, ProxyTimeoutError):
+            raise
+        except OSError as e:
+            raise client_exceptions.ClientOSError(e.errno, f"Cannot connect to {self.host}:{self.port}: {e}") from e
+        finally:
+            self.opening -= 1
+        self.connections.append(connection)
+        self.stats["connections"] += 1
+        return connection
+
+    async def request(self, request):
+        while True:
+            connection = await self.acquire()
+            if connection.served or connection.pending:
+                self.stats["reused"] += 1
+            request.future = asyncio.get_running_loop().create_future()
+            connection.send(request)
+            try:
+                return await request.future
+            except Resend:
+                request.resent = request.resent or connection.keep_alive
+            except asyncio.CancelledError:
+                if request.future.cancelled():
+                    # Timed out or dropped: whatever is queued behind it on the connection would wait for its
+                    # response, so the connection goes and the requests queued behind it are sent again
+                    if len(connection.pending) > 1:
+                        self.pipelining = False
+                    connection.abort()
+                raise
+
+    def connection_lost(self, connection, receiving):
+        self.connections.remove(connection)
+        # Requests queued behind a response announcing the close were never looked at by the server
+        announced = not connection.keep_alive
+        if not announced and len(connection.pending) > 1 and not connection.served:
+            self.pipelining = False
+        for i, request in enumerate(connection.pending):
+            if request.future.done():
+                continue
+            if not announced and (request.resent or (i == 0 and receiving)):
+                request.future.set_exception(client_exceptions.ServerDisconnectedError())
+            else:
+                request.future.set_exception(Resend())
+        connection.pending.clear()
+        self.wake()
+
+    def wake(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def close(self):
+        for connection in list(self.connections):
+            connection.abort()
+
+
+class RawClient:
+    """Minimal HTTP/1.1 client of a single proxy, or of the direct connection.
+
+    Sends hand-written GET and HEAD requests over persistent, pipelined connections and parses nothing
+    the scanner does not need. Redirects are never followed and HTTPS through HTTP proxies is left to aiohttp.
+    """
+
+    def __init__(self, config, socks=None, http_proxy=None, credentials=None):
+        self.config = config
+        self.limit = config.max_connections_per_host
+        self.depth = max(config.pipeline_depth, 1)
+        self.timeout = config.timeout
+        self.body_limit = config.body_limit
+        self.pools = {}  # target_id -> RawPool
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.socks = socks  # (ProxyType, host, port, rdns)
+        self.http_proxy = http_proxy  # (host, port)
+        self.credentials = credentials  # Called with the target when every target gets its own SOCKS credentials
+
+    def handles(self, target):
+        if self.config.follow_redirects:
+            return False
+        return not (self.http_proxy and target.target_url.startswith("https://"))
+
+    def pool(self, target):
+        pool = self.pools.get(target.target_id)
+        if pool is None:
+            credentials = self.credentials(target) if self.credentials else None
+            pool = self.pools[target.target_id] = RawPool(self, target, credentials)
+        return pool
+
+    async def request(self, method, url, target, read_body):
+        pool = self.pool(target)
+        return await asyncio.wait_for(pool.request(pool.build(method, url, target, read_body)), self.timeout)
+
+    def release(self, target_id):
+        pool = self.pools.pop(target_id, None)
+        if pool is not None:
+            pool.close()
+        return pool
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        self.pools.clear()
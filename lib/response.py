@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+from collections import namedtuple
+from hashlib import sha1
+from urllib.parse import quote, unquote
+
+# Everything the scanner needs from a reply, detached from the aiohttp response and its connection
+ScanResponse = namedtuple("ScanResponse", ["url", "path", "status", "content_length", "location", "digest",
+                                           "latency"])
+
+
+CHUNK_SIZE = 16384
+
+
+# Bytes which may continue a path, an echo followed by one of them is part of a longer path
+PATH_BYTES = frozenset(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.~%-")
+PATH_BYTES |= frozenset(range(128, 256))
+
+
+def echo_forms(path, sent_path=None):
+    # The path, also without its query string, as the client normalized it (sent_path) and as the server decoded
+    # it, each plain, percent-encoded and fully percent-encoded (as in ?next=%2Fadmin). Lower case, longest first
+    if not path:
+        return []
+    paths = set()
+    for sent in (path, path.split("?", 1)[0]):
+        paths.update(("/" + sent, "/" + unquote(sent)))
+    if sent_path:
+        paths.update((sent_path, unquote(sent_path)))
+    forms = {form.lower().encode("utf-8", "surrogateescape") for path in paths if path != "/"
+             for form in (path, quote(path), quote(path, safe=""))}
+    return sorted(forms, key=len, reverse=True)
+
+
+def cut_echoes(body, forms):
+    # Case-insensitive, and only whole paths are cut: "/l" is not cut out of "/login"
+    lowered = body.lower()
+    for form in forms:
+        kept = []
+        start = 0
+        i = lowered.find(form)
+        while i >= 0:
+            end = i + len(form)
+            if end < len(body) and body[end] in PATH_BYTES:
+                i = lowered.find(form, i + 1)
+                continue
+            kept.append((start, i))
+            start = end
+            i = lowered.find(form, end)
+        if kept:
+            kept.append((start, len(body)))
+            body = b"".join(body[a:b] for a, b in kept)
+            lowered = b"".join(lowered[a:b] for a, b in kept)
+    return body
+
+
+def strip_path(text, path, sent_path=None):
+    data = text.encode("utf-8", "surrogateescape")
+    return cut_echoes(data, echo_forms(path, sent_path)).decode("utf-8", "surrogateescape")
+
+
+def body_digest(body, path, sent_path=None):
+    # Soft-404 pages often repeat the requested path, it is cut out so they hash the same for every path
+    return sha1(cut_echoes(bytes(body), echo_forms(path, sent_path))).hexdigest()
+
+
+async def digest_limited(stream, limit, path, sent_path=None):
+    # Only the first limit bytes are read and hashed
+    body = bytearray()
+    while len(body) < limit:
+        chunk = await stream.read(min(limit - len(body), CHUNK_SIZE))
+        if not chunk:
+            break
+        body += chunk
+    return body_digest(body, path, sent_path) if body else None, len(body)
+
+
+async def make_response(response, path, latency, read_body=False, body_limit=65536):
+    digest, size = None, 0
+    if read_body:
+        digest, size = await digest_limited(response.content, body_limit, path, response.url.raw_path)
+    content_length = response.content_length if response.content_length is not None else size
+    return ScanResponse(url=str(response.url), path=path, status=response.status, content_length=content_length,
+                        location=response.headers.get('Location'), digest=digest, latency=latency)
+
+
+def make_raw_response(response, path, latency):
+    # The raw engine has already hashed the body while parsing it
+    return ScanResponse(url=response.url, path=path, status=response.status, content_length=response.content_length,
+                        location=response.location, digest=response.digest, latency=latency)
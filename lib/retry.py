@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+import heapq
+from collections import namedtuple
+from itertools import count
+from random import uniform
+from time import monotonic
+
+RetryPolicy = namedtuple("RetryPolicy", ["attempts", "backoff"])
+
+# Transient server answers, worth asking again later. A plain 500 is kept as a finding
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def error_class(result):
+    if isinstance(result, asyncio.exceptions.TimeoutError):
+        return "timeout"
+    if isinstance(result, Exception):
+        return "reset"
+    if result.status in RETRY_STATUSES:
+        return "server"
+    return None
+
+
+def retry_policies(config):
+    return {
+        "timeout": RetryPolicy(config.timeout_attempts, config.timeout_backoff),
+        "reset": RetryPolicy(config.max_retries, config.reset_backoff),
+        "server": RetryPolicy(config.server_attempts, config.server_backoff),
+    }
+
+
+class HostBackoff:
+    """Exponential backoff with jitter, growing with consecutive failures of a single host"""
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.level = 0
+        self.until = 0.0
+
+    def on_success(self):
+        self.level = 0
+
+    def on_failure(self, base):
+        now = monotonic()
+        if now >= self.until:
+            self.level += 1  # Requests failing in the same burst back the host off only once
+        delay = min(self.cap, base * 2 ** min(self.level - 1, 16))
+        delay = delay / 2 + uniform(0, delay / 2)
+        self.until = max(self.until, now + delay)
+        return delay
+
+
+class RetryQueue:
+    """Requests waiting for their backoff to expire, ordered by due time"""
+
+    def __init__(self):
+        self.heap = []
+        self.seq = count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, delay, target_id, url, index, attempt):
+        heapq.heappush(self.heap, (monotonic() + delay, next(self.seq), target_id, url, index, attempt))
+
+    def pop_due(self):
+        if self.heap and self.heap[0][0] <= monotonic():
+            return heapq.heappop(self.heap)[2:]
+        return None
+
+    def drop(self, target_id):
+        size = len(self.heap)
+        self.heap = [item for item in self.heap if item[2] != target_id]
+        heapq.heapify(self.heap)
+        return size - len(self.heap)
+
+    def next_due(self):
+        return max(self.heap[0][0] - monotonic(), 0.0) if self.heap else None
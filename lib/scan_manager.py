@@ -18,187 +18,498 @@
 
 import asyncio
 import signal
-from aiohttp import ClientSession, ClientTimeout, TCPConnector, client_exceptions
-from aiohttp.helpers import BasicAuth
-from aiohttp_socks import ProxyConnector
-from lib.util import chunks, sizeof_fmt
+from aiohttp import client_exceptions
+from lib.util import ThroughputMeter
+from lib.response import make_response, make_raw_response
+from lib.wildcard import calibration_paths
+from lib.paths import discovered_directory
+from lib.congestion import CONGESTION_STATUSES, window_summary
+from lib.proxy_pool import ProxyPool
+from lib.rate_limit import MIN_SLEEP, TokenBucket
+from lib.scan_target import target_count
+from lib.retry import RetryQueue, error_class, retry_policies
+from lib.journal import Journal
+from lib.event_loop import new_event_loop
+from lib.metrics import Metrics
+from lib.writer import ResultWriter
 from lib.logger import get_logger, TqdmLoggingHandler
 from tqdm.asyncio import tqdm
-from collections import defaultdict
-import gc
+from collections import deque
+from itertools import count
+import heapq
+from time import monotonic
 
 
 class ScanManager:
     def __init__(self, config, targets):
         self.config = config
-        self.targets = targets
-        if self.config.url:
-            total = len(self.config.pathlist)
-        else:
-            total = len(self.config.pathlist) * len(self.config.url_list)
-        self.pbar = tqdm(total=total, ascii=True, position=0, leave=False, dynamic_ncols=True)
+        self.targets = {}  # Active targets only, filled lazily from the target iterator by generate_links
+        self.target_source = iter(targets)
+        self.reactivated = deque()  # Exhausted targets with newly discovered directories
+        self.started_targets = 0
+        self.pbar = self.create_progress(len(self.config.pathlist) * target_count(self.config))
         self.logger = get_logger('SCAN', 'INFO', handler=TqdmLoggingHandler(self.pbar))
         self.scan_logger = get_logger('URL', 'INFO', log_format="[%(asctime)s] %(message)s",
                                       handler=TqdmLoggingHandler(self.pbar))
-        self.sessions = []
-        self.loop = asyncio.get_event_loop()
+        self.loop, self.loop_backend = new_event_loop(self.config.event_loop)
+        if self.loop_backend != self.config.event_loop and self.config.event_loop != "auto":
+            self.logger.warning(f"Event loop backend {self.config.event_loop} is not available, "
+                                f"using {self.loop_backend}")
         self.loop.set_exception_handler(self.handle_exception)
         self.setup_sighandler()
-        if not self.config.proxy:
-            self.conn = TCPConnector(limit=self.config.max_connections,
-                                     limit_per_host=self.config.max_connections_per_host,
-                                     ttl_dns_cache=300)
-        else:
-            if self.config.proxy.startswith('socks5h'):
-                proxy_addr = self.config.proxy.replace("socks5h", "socks5")
-                self.conn = ProxyConnector.from_url(proxy_addr)
-                self.conn._rdns = True
-        self.tasks = defaultdict(list)
+        self.in_flight = 0  # Requests of all targets, counted instead of keeping their tasks around
+        self.slot_free = asyncio.Event()
+        self.meter = ThroughputMeter()
         self.sem = asyncio.Semaphore(self.config.max_connections)
-        self.setup_sessions()
+        self.bucket = TokenBucket(self.config.rate, self.config.burst) if self.config.rate else None
+        self.retry_queue = RetryQueue()
+        self.retry_policies = retry_policies(self.config)
+        self.writer = ResultWriter(self.config, self.scan_logger, self.logger)
+        self.metrics = None
+        trace_configs = None
+        if self.config.metrics_file or self.config.metrics_port:
+            self.metrics = Metrics(self.config)
+            trace_configs = [self.metrics.trace_config()]
+        self.proxies = ProxyPool(self.config, trace_configs)
         self.running = asyncio.Event()
         self.running.set()
+        self.target_ready = asyncio.Event()
+        self.woken = set()  # Targets which may have become ready since generate_links last looked at them
+        self.closing = False
+        self.shutdown_task = None
+        self.journal = None
+        if self.config.journal or self.config.resume:
+            self.journal = Journal(self.config)
+            self.logger.info(f"Writing journal to {self.journal.path}")
+            if self.config.resume:
+                self.restore_journal()
+
+    @staticmethod
+    def create_progress(total):
+        return tqdm(total=total, ascii=True, position=0, leave=False, dynamic_ncols=True)
+
+    def restore_journal(self):
+        finished, blocked = self.journal.summary()
+        self.logger.info(f"Journal: {finished} targets finished, {blocked} targets given up on")
+        if self.journal.pathlist_size is not None and self.journal.pathlist_size != len(self.config.pathlist):
+            self.logger.warning(f"Journal was written for a pathlist of {self.journal.pathlist_size} paths, "
+                                f"current one has {len(self.config.pathlist)}")
 
     def handle_exception(self, loop, context):
         msg = context.get("exception", context["message"])
         self.logger.error(f"Caught exception: {msg}")
 
-    @staticmethod
-    async def add_callback(fut, callback):
-        try:
-            result = await fut
-            await callback(result)
-            return result
-        except asyncio.exceptions.CancelledError:
-            # Ignore cancelled requests
-            pass
-
-    async def fetch_callback(self, task):
+    def fetch_callback(self, task):
         self.pbar.update()
+        self.meter.tick()
         target_id, result = task
+        target = self.targets[target_id]
 
-        if not self.targets[target_id].is_running():
+        if not target.is_running():
             return
         if not isinstance(result, Exception):
+            if target.circuit.on_success():
+                self.logger.info(f"Target {target.get_target_name()} answers again, resuming")
+                if self.journal:
+                    self.journal.set_errors(target)
             return
         elif isinstance(result, (client_exceptions.ServerDisconnectedError, client_exceptions.ClientOSError)):
-            self.logger.warning(f"Server dropped connection on target {self.targets[target_id].get_target_name()}")
+            self.logger.warning(f"Server dropped connection on target {target.get_target_name()}")
         elif isinstance(result, asyncio.exceptions.TimeoutError):
-            self.logger.warning(f"Timeout occured on target {self.targets[target_id].get_target_name()}")
+            self.logger.warning(f"Timeout occured on target {target.get_target_name()}")
         else:
             self.logger.warning(f"Error occured on target {target_id}: {str(result)}")
 
-        self.targets[target_id].inc_error_counter()
-        if self.targets[target_id].get_error_status():
-            await self.block_target(target_id)
+        tripped = target.circuit.on_failure()
+        if self.journal:
+            self.journal.set_errors(target)
+        if not tripped:
+            return
+        if target.circuit.is_exhausted():
+            self.block_target(target_id)
+        else:
+            cooldown = target.circuit.current_cooldown()
+            self.logger.warning(f"Pausing target {target.get_target_name()} for {cooldown:.0f}s")
+            self.loop.call_later(cooldown, self.wake, target_id)  # Let generate_links send the probe
 
-    async def block_target(self, target_id):
-        self.running.clear()
-        self.logger.warning(f"Giving up on target {self.targets[target_id].get_target_name()}")
-        self.targets[target_id].stop()
-        tasks = [t for t in self.tasks[target_id] if t is not asyncio.current_task()]
-        task_cnt = len(tasks)
-        self.logger.warning(f"Dropping {task_cnt} requests to target {self.targets[target_id].get_target_name()}")
-        [t.cancel() for t in tasks]
-        for t in tasks:
-            await t
-        self.pbar.update(task_cnt)
-        self.running.set()
+    def block_target(self, target_id):
+        # Only this target is torn down, the rest of the scan keeps going
+        target = self.targets[target_id]
+        self.logger.warning(f"Giving up on target {target.get_target_name()}")
+        target.stop()
+        self.writer.close_log(target)
+        if self.journal:
+            self.journal.block(target)
+        # Requests in flight are not cancelled one by one: those still waiting for a slot are not sent at all,
+        # the answers of the rest are thrown away
+        retries = self.retry_queue.drop(target_id)
+        target.retrying -= retries
+        dropped = retries + target.in_flight - 1  # The request being handled right now is not dropped
+        self.logger.warning(f"Dropping {dropped} requests to target {target.get_target_name()}")
+        self.pbar.update(retries)
 
-    async def fetch(self, target_id, url):
-        retries = 0
-        exception = None
+    async def send(self, method, url, path, target, session, proxy, target_metrics, read_body):
+        started = monotonic()
+        if session is None:
+            response = await proxy.raw.request(method, url, target, read_body)
+            latency = monotonic() - started
+            self.observe_response(target, response, latency)
+            return make_raw_response(response, path, latency)
+        async with session.request(method, url, ssl=False, allow_redirects=self.config.follow_redirects,
+                                   headers=target.headers, auth=target.auth, cookies=target.cookies,
+                                   proxy=proxy.request_proxy, trace_request_ctx=target_metrics) as response:
+            latency = monotonic() - started
+            self.observe_response(target, response, latency)
+            read_body = read_body and response.status != 404
+            return await make_response(response, path, latency, read_body, self.config.body_limit)
+
+    @staticmethod
+    def observe_response(target, response, latency):
+        if response.cookies:
+            target.save_cookies(response.cookies)
+        if response.status in CONGESTION_STATUSES:
+            target.window.on_congestion()
+        else:
+            target.window.on_success(latency)
+
+    async def fetch(self, target_id, url, calibration=False, attempt=0):
+        # A single attempt, failed requests are retried through the retry queue without holding a slot
+        target = self.targets[target_id]
+        path = target.get_path(url)
+        target_metrics = self.metrics.get(target) if self.metrics else None
         async with self.sem:
-            while retries < self.config.max_retries:
-                try:
-                    if self.config.http_method == "head":
-                        f = self.sessions[target_id % self.config.max_connections].head
-                    else:
-                        f = self.sessions[target_id % self.config.max_connections].get
-                    await self.running.wait()
-                    async with f(url, ssl=False, allow_redirects=self.config.follow_redirects) as response:
-                        return target_id, response
-                except Exception as e:
-                    exception = e
-                    retries += 1
-                    continue
-            return target_id, exception
-
-    async def create_task_group(self, r):
-        tasks = []
-        for target_id, url in r:
-            task = self.loop.create_task(self.add_callback(self.fetch(target_id, url), self.fetch_callback))
-            self.tasks[target_id].append(task)
-            tasks.append(task)
-        return tasks
-
-    async def process_task_group(self, tasks):
-        for f in asyncio.as_completed(tasks):
-            packed = await f
-            if not packed:
-                continue
-            await self.handle_response(packed)
+            await self.running.wait()
+            if not target.is_running():
+                return target_id, None  # Given up on while waiting for a slot, not sent at all
+            session, proxy = self.proxies.route(target)
+            started = monotonic()
+            # Bodies are only hashed when they may have to be told apart from a soft-404
+            read_body = calibration or bool(target.wildcard)
+            try:
+                if self.config.http_method == "head-get":
+                    # Most paths are 404 and need no body at all, the rest is fetched again with a capped GET
+                    result = await self.send("HEAD", url, path, target, session, proxy, target_metrics, False)
+                    if result.status != 404:
+                        result = await self.send("GET", url, path, target, session, proxy, target_metrics, True)
+                else:
+                    method = "HEAD" if self.config.http_method == "head" else "GET"
+                    result = await self.send(method, url, path, target, session, proxy, target_metrics, read_body)
+            except Exception as e:
+                target.window.on_congestion()
+                result = e
+        if self.proxies.on_result(proxy, result):
+            self.logger.warning(f"Proxy {proxy.name} is not answering, taking it out of rotation for "
+                                f"{proxy.circuit.current_cooldown():.0f}s")
+        if self.metrics:
+            self.metrics.observe_request(target_metrics, monotonic() - started, result)
+        return target_id, result
 
-    def cleanup_task_group(self):
-        for target_id in self.tasks.keys():
-            self.tasks[target_id] = []
-        gc.collect()
+    def schedule_retry(self, url, index, attempt, packed):
+        target_id, result = packed
+        target = self.targets[target_id]
+        kind = error_class(result)
+        if kind is None:
+            target.backoff.on_success()
+            return False
+        policy = self.retry_policies[kind]
+        if not target.is_running() or attempt + 1 >= policy.attempts:
+            return False
+        target.retrying += 1
+        self.retry_queue.push(target.backoff.on_failure(policy.backoff), target_id, url, index, attempt + 1)
+        return True
 
-    def setup_sessions(self):
-        for i in range(self.config.max_connections):
-            if self.config.auth:
-                auth = BasicAuth(login=self.config.auth[0], password=self.config.auth[1])
-            else:
-                auth = None
-            session = ClientSession(connector=self.conn, headers={'User-Agent': self.config.user_agent},
-                                    timeout=ClientTimeout(total=self.config.timeout),
-                                    skip_auto_headers=['Accept-Encoding'],
-                                    connector_owner=False, auth=auth)
-            self.sessions.append(session)
+    async def calibrate(self, target):
+        try:
+            urls = [target.target_url + '/' + path for path in calibration_paths(self.config.calibration_requests)]
+            responses = await asyncio.gather(*(self.fetch(target.target_id, url, True) for url in urls))
+            target.wildcard.learn((response, response.path) for _, response in responses
+                                  if not isinstance(response, Exception) and response.status != 404)
+            if target.wildcard:
+                self.logger.info(f"Target {target.get_target_name()} answers nonexistent paths, "
+                                 f"learned {len(target.wildcard)} soft-404 fingerprint(s)")
+        finally:
+            target.calibrated = True
+            self.wake(target.target_id)
+
+    async def request(self, target_id, url, index, attempt=0):
+        # The whole life of a request in a single coroutine: send it, then retry it or record the result
+        target = self.targets[target_id]
+        try:
+            packed = await self.fetch(target_id, url, attempt=attempt)
+            if packed[1] is None:
+                self.pbar.update()  # count dropped requests
+                return
+            if self.schedule_retry(url, index, attempt, packed):
+                return
+            if self.metrics:
+                self.metrics.observe_retries(target, attempt)
+            self.fetch_callback(packed)
+            hit = self.handle_response(packed)
+            if hit:
+                await self.writer.put(target, hit)
+            # Requests which never got an answer are not journaled, so a resumed scan sends them again
+            if isinstance(packed[1], Exception):
+                target.unanswered += 1
+            elif target.is_running():
+                if self.journal:
+                    self.journal.complete(target, index)
+                self.record_try(target, index, packed[1])
+        finally:
+            self.in_flight -= 1
+            target.in_flight -= 1
+            self.slot_free.set()
+            self.wake(target_id)
+            if target.is_finished():
+                self.finish_target(target_id)
+
+    def create_task(self, target_id, url, index, attempt=0):
+        target = self.targets[target_id]
+        if attempt:
+            target.retrying -= 1
+        target.in_flight += 1
+        self.in_flight += 1
+        # A pending task is referenced by whatever it waits on, the scan only counts it
+        self.loop.create_task(self.request(target_id, url, index, attempt))
+
+    def wake(self, target_id):
+        self.woken.add(target_id)
+        self.target_ready.set()
+
+    def start_target(self, target):
+        if self.journal and not self.journal.restore(target):
+            return False
+        self.targets[target.target_id] = target
+        self.started_targets += 1
+        target.start()
+        if not target.calibrated:
+            self.loop.create_task(self.calibrate(target))
+        return True
+
+    def finish_target(self, target_id):
+        target = self.targets.pop(target_id)
+        if self.journal and target.is_running() and not self.closing and not target.unanswered:
+            self.journal.finish(target)
+        if self.metrics:
+            self.metrics.drop(target)
+        self.proxies.release(target)
+        self.writer.close_log(target)
+
+    async def wait_in_flight(self, limit):
+        # Until at most limit requests are in flight
+        while self.in_flight > limit:
+            self.slot_free.clear()
+            await self.slot_free.wait()
 
     async def close_sessions(self):
         self.logger.info(f"Closing sessions")
-        for session in self.sessions:
-            await session.close()
+        await self.proxies.close()
 
-    async def handle_response(self, packed):
+    def handle_response(self, packed):
+        # Returns the response when it is a hit to be written out
         target_id, response = packed
-        if response and not isinstance(response, Exception) and response.status != 404:
-            content_length = response.content_length if response.content_length else 0
-            if response.status in (301, 302):
-                if 'Location' in response.headers:
-                    url = str(response.url) + ' -> ' + response.headers['Location']
-                else:
-                    url = str(response.url)
-            else:
-                url = str(response.url)
-            log_event = f'{str(response.status)} - {sizeof_fmt(content_length)}\t-\t{url}'
-            self.scan_logger.info(log_event)
-            self.targets[target_id].save_link(log_event + '\n')
+        target = self.targets[target_id]
+        if not target.is_running() or isinstance(response, Exception):
+            return None
+        if target.is_wildcard(response):
+            if target.get_wildcard_status():
+                self.logger.warning(f"Every response of target {target.get_target_name()} is a soft-404")
+                self.block_target(target_id)
+            return None
+        if response.status == 404:
+            return None
+        if self.config.path_stats:
+            self.config.path_stats.record_hit(response.path)
+        if self.config.recursion_depth:
+            directory = discovered_directory(response)
+            if directory:
+                self.add_directory(target, directory)
+        return response
+
+    def add_directory(self, target, directory):
+        added = target.add_directory(directory)
+        if not added:
+            return
+        self.extend_progress(added)
+        if target.exhausted:
+            target.exhausted = False
+            self.reactivated.append(target)
+            self.target_ready.set()
+
+    def extend_progress(self, count):
+        self.pbar.total += count
 
     def run_loop(self):
         try:
             self.loop.run_until_complete(self.run())
             self.loop.close()
+        except asyncio.exceptions.CancelledError:
+            # The scan was cancelled by shutdown(), let it flush everything before leaving the loop
+            if self.shutdown_task:
+                self.loop.run_until_complete(self.shutdown_task)
+            raise
         except Exception as e:
             print(str(e))
 
-    def generate_links(self):
-        generators = [x.link_generator() for x in self.targets]
-        for urls in zip(*generators):
-            for url in urls:
-                if url[1]:
-                    yield url
-                else:
+    async def generate_links(self):
+        # Weighted fair queuing over a bounded set of active targets: the ready target with the least virtual time,
+        # requests sent divided by its weight, goes next. Targets that are not ready wait aside until woken up
+        active = []
+        blocked = {}
+        order = count()
+        vtime = 0.0
+        while True:
+            while not self.config.max_active_targets or len(active) + len(blocked) < self.config.max_active_targets:
+                target = next(self.target_source, None)
+                if target is None:
+                    break
+                if not self.start_target(target):
+                    self.pbar.update(target.get_path_count())  # count requests done by a previous run
+                    continue
+                heapq.heappush(active, (vtime, next(order), target, target.link_generator()))
+            while self.reactivated:
+                target = self.reactivated.popleft()
+                heapq.heappush(active, (vtime, next(order), target, target.directory_generator()))
+            for target_id in self.woken:
+                entry = blocked.pop(target_id, None)
+                if entry:
+                    heapq.heappush(active, entry)
+            self.woken.clear()
+            retry = self.retry_queue.pop_due()
+            if retry is not None:
+                target = self.targets[retry[0]]
+                if not target.is_running():
+                    target.retrying -= 1
                     self.pbar.update()  # count dropped requests
+                    if target.is_finished():
+                        self.finish_target(target.target_id)
+                elif target.is_ready() and not target.token_delay():
+                    target.take_token()
+                    yield retry
+                else:
+                    self.retry_queue.push(target.retry_delay() or self.config.reset_backoff, *retry)
+                continue
+            if not active and not blocked and not self.retry_queue and not (self.config.recursion_depth
+                                                                             and self.targets):
+                # With recursion on, requests still in flight may yet find a directory to scan
+                return
+            if not active:
+                # Every active target is either being calibrated or has its window full, or only retries are left
+                self.target_ready.clear()
+                if not self.woken:
+                    await self.wait_ready()
+                continue
+            entry = heapq.heappop(active)
+            target_vtime, _, target, links = entry
+            if not target.is_ready():
+                blocked[target.target_id] = entry
+                continue
+            delay = target.token_delay()
+            if delay:
+                blocked[target.target_id] = entry
+                self.loop.call_later(max(delay, MIN_SLEEP), self.wake, target.target_id)
+                continue
+            link = next(links, None)
+            if link is None:
+                if target.is_finished():
+                    self.finish_target(target.target_id)
+                continue
+            vtime = target_vtime
+            if link[1]:
+                heapq.heappush(active, (target_vtime + 1 / target.weight, next(order), target, links))
+                target.take_token()
+                yield link + (0,)
+            else:
+                heapq.heappush(active, (target_vtime, next(order), target, links))
+                self.pbar.update()  # count dropped requests
+
+    async def wait_ready(self):
+        try:
+            await asyncio.wait_for(self.target_ready.wait(), self.retry_queue.next_due())
+        except asyncio.exceptions.TimeoutError:
+            pass
+
+    async def throttle(self):
+        delay = self.bucket.take()
+        if delay >= MIN_SLEEP:
+            await asyncio.sleep(delay)
+
+    async def run_chunked(self):
+        sent = 0
+        async for link in self.generate_links():
+            if self.bucket:
+                await self.throttle()
+            self.create_task(*link)
+            sent += 1
+            if sent % self.config.chunk_size == 0:
+                await self.wait_in_flight(0)
+        await self.wait_in_flight(0)
+
+    async def run_pipeline(self):
+        # Keep up to max_connections requests in flight and refill the window as soon as any of them completes
+        async for link in self.generate_links():
+            await self.wait_in_flight(self.config.max_connections - 1)
+            if self.bucket:
+                await self.throttle()
+            self.create_task(*link)
+        await self.wait_in_flight(0)
+
+    def record_try(self, target, index, response):
+        # Only paths which got an answer count, a timeout says nothing about whether the path exists
+        if self.config.path_stats:
+            self.config.path_stats.record_try(response.path)
+
+    async def report_throughput(self):
+        while True:
+            await asyncio.sleep(1)
+            windows = [(target.get_target_name(), target.window) for target in self.targets.values()
+                       if target.is_running()]
+            self.pbar.set_postfix_str(f"{self.meter.sample():.0f} req/s {window_summary(windows)}", refresh=False)
+
+    async def start_metrics(self):
+        autodump = runner = None
+        if self.config.metrics_file:
+            autodump = self.loop.create_task(self.metrics.autodump())
+        if self.config.metrics_port:
+            runner = await self.metrics.start_server()
+        return autodump, runner
+
+    async def stop_metrics(self, autodump, runner):
+        if autodump:
+            autodump.cancel()
+            await self.metrics.dump()
+        if runner:
+            await runner.cleanup()
 
     async def run(self):
-        for chunk in chunks(self.generate_links(), self.config.chunk_size):
-            tasks = await self.create_task_group(chunk)
-            await self.process_task_group(tasks)
-            self.cleanup_task_group()
+        reporter = self.loop.create_task(self.report_throughput())
+        writer = self.loop.create_task(self.writer.run())
+        if self.journal:
+            autoflush = self.loop.create_task(self.journal.autoflush())
+        if self.metrics:
+            exporters = await self.start_metrics()
+        self.meter.start()
+        if self.config.scheduler == "chunked":
+            await self.run_chunked()
+        else:
+            await self.run_pipeline()
+        self.meter.stop()
+        reporter.cancel()
+        writer.cancel()
+        await self.writer.close()
+        if self.journal:
+            autoflush.cancel()
+            await self.journal.close()
+        if self.metrics:
+            await self.stop_metrics(*exporters)
+        if self.config.path_stats:
+            # Only complete scans are counted, so a resumed scan gets its paths in the same order
+            await self.loop.run_in_executor(None, self.config.path_stats.save)
+        self.logger.info(f"{self.meter.total} requests in {self.meter.elapsed:.1f}s "
+                         f"({self.config.scheduler} scheduler, {self.loop_backend} loop): "
+                         f"{self.meter.average:.1f} req/s average, {self.meter.peak:.0f} req/s peak")
+        if len(self.proxies) > 1 or self.proxies.is_isolated():
+            self.logger.info(f"Proxies: {self.proxies.summary()}")
         await self.close_sessions()
-        await self.conn.close()
 
     def setup_sighandler(self):
         signals = (signal.SIGHUP, signal.SIGTERM)
@@ -232,15 +543,19 @@ class ScanManager:
 
     async def shutdown(self, signal_evt):
         self.logger.warning(f'Received exit signal {signal_evt.name}...')
+        self.closing = True
+        self.shutdown_task = asyncio.current_task()
         tasks = [t for t in asyncio.all_tasks() if t is not
                  asyncio.current_task()]
         [task.cancel() for task in tasks]
         self.logger.info(f"Cancelling {len(tasks)}  requests")
-        await asyncio.gather(*tasks)
+        await asyncio.gather(*tasks, return_exceptions=True)
         await self.close_sessions()
+        if self.journal:
+            self.logger.info(f"Flushing journal")
+            await self.journal.close()
         self.logger.info(f"Flusing log files")
-        for target in self.targets:
-            if target.is_running():
-                target.close_log()
+        for target in self.targets.values():
+            self.writer.close_log(target)
+        await self.writer.close()
         await asyncio.sleep(self.config.giveup_timeout)
-        self.loop.stop()
@@ -17,48 +17,190 @@
 #  Author: Enemy Submarine
 
 
+from collections import deque
 from urllib.parse import urlparse
+from aiohttp.helpers import BasicAuth
 from datetime import datetime
+from time import monotonic
 from os.path import join
 
+from lib.circuit import CircuitBreaker
+from lib.congestion import AimdWindow, CONGESTION_STATUSES
+from lib.rate_limit import TokenBucket
+from lib.retry import HostBackoff
+from lib.util import normalize_url
+from lib.wildcard import WildcardFilter
+
+
+def prepare_targets(config):
+    if config.url:
+        return [ScanTarget(0, normalize_url(config.url), config)]
+    # In worker mode every process only takes its own shard of the target list
+    return (live_target(parse_target(i, line, config)) for i, line in enumerate(config.url_list)
+            if (config.shard_paths or i % config.shard_count == config.shard_index)
+            and (config.live_targets is None or i in config.live_targets))
+
+
+def target_count(config):
+    if config.url:
+        return 1
+    if config.live_targets is not None:
+        return len(config.live_targets)
+    return len(config.url_list)
+
+
+def parse_target(target_id, line, config):
+    # A target list line is an URL, optionally followed by its scheduling weight: "http://example.onion 4",
+    # anything after the weight is ignored
+    url, _, rest = line.strip().partition(' ')
+    fields = rest.split()
+    try:
+        weight = max(float(fields[0]), 0.01) if fields else 1.0
+    except ValueError:
+        weight = 1.0
+    return ScanTarget(target_id, normalize_url(url), config, weight)
+
+
+def live_target(target):
+    # Latency measured by the preflight stage is the first round trip estimate of the window
+    if target.config.live_targets:
+        target.window.seed(target.config.live_targets[target.target_id])
+    return target
+
 
 class ScanTarget:
-    def __init__(self, target_id, target_url, config):
+    def __init__(self, target_id, target_url, config, weight=1.0):
         self.target_id = target_id
         self.target_url = target_url
         self.config = config
-        self.logfile = self.init_log()
-        self.err_cnt = 0
+        self.weight = weight
+        self.requests = 0
+        self.started = None
+        self.logfile = None
+        self.circuit = CircuitBreaker(config.max_errors, config.circuit_cooldown, config.circuit_trips)
+        self.in_flight = 0
+        self.retrying = 0
+        self.unanswered = 0  # Requests given up on after their last retry, a resumed scan sends them again
+        self.exhausted = False
         self.running = True
+        self.wildcard = WildcardFilter(config.wildcard_length_bucket)
+        self.calibrated = not config.calibrate
+        self.responses = 0
+        self.wildcard_hits = 0
+        self.headers = {'User-Agent': config.user_agent}
+        self.auth = BasicAuth(login=config.auth[0], password=config.auth[1]) if config.auth else None
+        self.cookies = None
+        self.proxy = None  # Assigned by ProxyPool
+        self.done = None  # Path indices completed by a previous run, see Journal.restore
+        self.directories = deque()  # Discovered directories waiting for a recursive pass
+        self.seen_directories = set()
+        self.recursive_requests = 0
+        self.next_index = len(config.pathlist)
+        self.window = AimdWindow(config.initial_window, config.min_window, config.max_connections_per_host,
+                                 config.window_decrease, config.latency_factor, config.adaptive_concurrency)
+        self.backoff = HostBackoff(config.backoff_cap)
+        self.bucket = TokenBucket(config.host_rate, config.host_burst) if config.host_rate else None
+
+    def start(self):
+        self.started = monotonic()
+        self.logfile = self.init_log()
 
     def init_log(self):
-        ts = datetime.strftime(datetime.now(), "%d-%m-%y_%H_%M")
+        ts = datetime.strftime(self.config.started, "%d-%m-%y_%H_%M")
         site_name = urlparse(self.target_url).netloc.replace(':', '_')
         file_name = f"{ts}_{site_name}.txt"
-        return open(join(self.config.logs, file_name), "w")
+        if self.config.shard_paths:
+            # Several workers share the log of a path-sharded target, line buffering keeps every hit a single write
+            return open(join(self.config.logs, file_name), "a", buffering=1)
+        # A resumed scan appends to the log file of the interrupted one, see Journal.started
+        return open(join(self.config.logs, file_name), "a" if self.config.resume else "w")
 
     def save_link(self, event):
         self.logfile.write(event)
 
+    def get_path_count(self):
+        if self.config.shard_paths:
+            return len(range(self.config.shard_index, len(self.config.pathlist), self.config.shard_count))
+        return len(self.config.pathlist)
+
     def link_generator(self):
-        for url in self.config.pathlist:
-            if self.running:
-                yield self.target_id, self.target_url + '/' + url
+        for index, url in enumerate(self.config.pathlist):
+            if self.config.shard_paths and index % self.config.shard_count != self.config.shard_index:
+                continue
+            if self.running and not (self.done and index in self.done) and self.within_budget():
+                self.requests += 1
+                yield self.target_id, self.target_url + '/' + url, index
             else:
-                yield self.target_id, None
+                yield self.target_id, None, index
+        yield from self.directory_generator()
+
+    def directory_generator(self):
+        # Directories of a path-sharded target are scanned in full by the worker which found them
+        while self.directories:
+            base = self.target_url + '/' + self.directories.popleft() + '/'
+            for url in self.config.pathlist:
+                index = self.next_index
+                self.next_index += 1
+                if self.running and not (self.done and index in self.done) and self.within_budget():
+                    self.requests += 1
+                    yield self.target_id, base + url, index
+                else:
+                    yield self.target_id, None, index
+        self.exhausted = True
+
+    def within_budget(self):
+        # Paths over the budget are dropped, the target still finishes normally
+        if self.config.request_budget and self.requests >= self.config.request_budget:
+            return False
+        return not self.config.time_budget or monotonic() - self.started < self.config.time_budget
+
+    def add_directory(self, directory):
+        # Returns how many requests were queued for the directory
+        if directory in self.seen_directories or directory.count('/') >= self.config.recursion_depth:
+            return 0
+        self.seen_directories.add(directory)
+        count = len(self.config.pathlist)
+        if self.recursive_requests + count > self.config.recursion_budget:
+            return 0
+        self.recursive_requests += count
+        self.directories.append(directory)
+        return count
 
     def close_log(self):
-        self.logfile.flush()
-        self.logfile.close()
+        if self.logfile:
+            self.logfile.flush()
+            self.logfile.close()
+            self.logfile = None
+
+    @property
+    def err_cnt(self):
+        return self.circuit.failures
+
+    @err_cnt.setter
+    def err_cnt(self, value):
+        self.circuit.failures = value
+
+    def save_cookies(self, cookies):
+        if self.cookies is None:
+            self.cookies = {}
+        for name, morsel in cookies.items():
+            self.cookies[name] = morsel.value
 
-    def inc_error_counter(self):
-        self.err_cnt += 1
-        return
+    def get_path(self, url):
+        return url[len(self.target_url) + 1:]
 
-    def get_error_status(self):
-        if self.err_cnt > self.config.max_errors:
-            return True
-        return False
+    def is_wildcard(self, response):
+        if response.status not in CONGESTION_STATUSES:
+            self.responses += 1  # "Slow down" replies say nothing about the content
+        if not self.wildcard or not self.wildcard.match(response, response.path):
+            return False
+        self.wildcard_hits += 1
+        return True
+
+    def get_wildcard_status(self):
+        # Every single response so far was a soft-404, the rest of the pathlist is not worth sending
+        abort_after = self.config.wildcard_abort_after
+        return abort_after and self.responses >= abort_after and self.wildcard_hits == self.responses
 
     def get_target_name(self):
         return urlparse(self.target_url).netloc
@@ -66,6 +208,25 @@ class ScanTarget:
     def is_running(self):
         return self.running
 
+    def is_ready(self):
+        # Stopped targets are always ready, so their remaining links get drained
+        return not self.running or (self.calibrated and self.circuit.allow(self.in_flight)
+                                    and self.window.available(self.in_flight))
+
+    def token_delay(self):
+        # Checked apart from is_ready(), a target held back only by its rate limit needs a timer to wake it up
+        return self.bucket.delay() if self.bucket and self.running else 0.0
+
+    def retry_delay(self):
+        # Time left until the cool-down, backoff or rate limit lets a retry through, 0 when only a slot is missing
+        return max(self.circuit.cooldown_left(), self.backoff.until - monotonic(), self.token_delay(), 0.0)
+
+    def take_token(self):
+        if self.bucket:
+            self.bucket.take()
+
+    def is_finished(self):
+        return self.exhausted and not self.in_flight and not self.retrying
+
     def stop(self):
         self.running = False
-        self.close_log()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+from aiohttp import ClientSession, ClientTimeout, DummyCookieJar
+
+
+class SessionPool:
+    """Small fixed set of sessions sharing one connector.
+
+    Sessions carry no per-target state: cookies, auth and headers are kept by ScanTarget and
+    passed along with every request.
+    """
+
+    def __init__(self, connector, size, timeout, trace_configs=None):
+        self.connector = connector
+        self.sessions = [ClientSession(connector=connector, timeout=ClientTimeout(total=timeout),
+                                       cookie_jar=DummyCookieJar(), skip_auto_headers=['Accept-Encoding'],
+                                       connector_owner=False, trace_configs=trace_configs)
+                         for _ in range(max(size, 1))]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, target_id):
+        return self.sessions[target_id % len(self.sessions)]
+
+    async def close(self):
+        for session in self.sessions:
+            await session.close()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import csv
+import json
+import sqlite3
+from collections import namedtuple
+from datetime import datetime
+from os.path import basename, join
+from time import time
+from urllib.parse import urlparse
+
+HitRecord = namedtuple("HitRecord", ["timestamp", "target", "path", "url", "status", "size", "location", "latency"])
+
+
+def make_record(target, response):
+    return HitRecord(timestamp=time(), target=target.target_url, path=response.path, url=response.url,
+                     status=response.status, size=response.content_length, location=response.location,
+                     latency=round(response.latency, 6))
+
+
+class JsonlSink:
+    extension = "jsonl"
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, records):
+        self.file.write("".join(json.dumps(record._asdict()) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink:
+    extension = "csv"
+
+    def __init__(self, path):
+        self.file = open(path, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(HitRecord._fields)
+
+    def write(self, records):
+        self.writer.writerows(records)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SqliteSink:
+    extension = "sqlite"
+
+    def __init__(self, path):
+        # Only the writer thread uses the connection, but it is created on the event loop thread
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")  # Readers can query the results while the scan is running
+        self.db.execute("CREATE TABLE IF NOT EXISTS hits (timestamp REAL, target TEXT, path TEXT, url TEXT, "
+                        "status INTEGER, size INTEGER, location TEXT, latency REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_target ON hits (target)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_status ON hits (status)")
+        self.db.commit()
+
+    def write(self, records):
+        with self.db:
+            self.db.executemany("INSERT INTO hits VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    def close(self):
+        self.db.close()
+
+
+SINKS = {sink.extension: sink for sink in (JsonlSink, CsvSink, SqliteSink)}
+
+
+def default_output_path(config, output_format):
+    ts = datetime.strftime(config.started, "%d-%m-%y_%H_%M")
+    name = basename(config.url_list_name) if config.url_list else urlparse(config.url).netloc.replace(':', '_')
+    return join(config.logs, f"{ts}_{name}.{output_format}")
+
+
+def open_sinks(config):
+    sinks = []
+    for output_format, path in config.outputs:
+        path = path or default_output_path(config, output_format)
+        if config.shard_count > 1 and output_format != "sqlite":
+            path = f"{path}.{config.shard_index}"  # SQLite handles several writer processes by itself
+        sinks.append(SINKS[output_format](path))
+    return sinks
@@ -17,15 +17,28 @@
 #  Author: Enemy Submarine
 
 
-from itertools import islice, chain
+from time import monotonic
 from urllib.parse import urlparse, urlunparse
 
 
-def chunks(iterable, size):
-    iterator = iter(iterable)
+class LineFile:
+    """Read-only sequence of lines backed by a file, reopened on every iteration"""
 
-    for first in iterator:
-        yield chain([first], islice(iterator, size - 1))
+    def __init__(self, path):
+        self.path = path
+        self.name = path
+        self._len = None
+
+    def __iter__(self):
+        with open(self.path, errors="replace") as f:
+            for line in f:
+                yield line.rstrip()
+
+    def __len__(self):
+        if self._len is None:
+            with open(self.path, "rb") as f:
+                self._len = sum(1 for _ in f)
+        return self._len
 
 
 def sizeof_fmt(num, suffix='B'):
@@ -43,3 +56,41 @@ def normalize_url(url):
         url = "http://" + url.lstrip('/')
         parsed = urlparse(url)
     return urlunparse(parsed)
+
+
+class ThroughputMeter:
+    def __init__(self):
+        self.total = 0
+        self.peak = 0.0
+        self.started = None
+        self.stopped = None
+        self.last_total = 0
+        self.last_sample = None
+
+    def start(self):
+        self.started = self.last_sample = monotonic()
+
+    def stop(self):
+        self.sample()
+        self.stopped = monotonic()
+
+    def tick(self, n=1):
+        self.total += n
+
+    def sample(self):
+        # Requests per second since the previous sample
+        now = monotonic()
+        rate = (self.total - self.last_total) / max(now - self.last_sample, 1e-9)
+        self.last_total, self.last_sample = self.total, now
+        self.peak = max(self.peak, rate)
+        return rate
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.stopped or monotonic()) - self.started
+
+    @property
+    def average(self):
+        return self.total / self.elapsed if self.elapsed else 0.0
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from lib.response import strip_path
+
+# Shapes of the nonexistent paths requested during calibration, servers often route them differently
+CALIBRATION_PATHS = ("{}", "{}.php", "{}/", ".{}", "{}.html")
+
+
+def calibration_paths(count):
+    return [CALIBRATION_PATHS[i % len(CALIBRATION_PATHS)].format(uuid4().hex) for i in range(count)]
+
+
+class WildcardFilter:
+    """Soft-404 fingerprints of a single target"""
+
+    def __init__(self, length_bucket):
+        self.length_bucket = max(length_bucket, 1)
+        self.fingerprints = set()
+
+    def __bool__(self):
+        return bool(self.fingerprints)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def dump(self):
+        return {"length_bucket": self.length_bucket, "fingerprints": [list(fp) for fp in self.fingerprints]}
+
+    def load(self, state):
+        self.length_bucket = state["length_bucket"]
+        self.fingerprints = {tuple(fp) for fp in state["fingerprints"]}
+
+    def fingerprint(self, response, path):
+        # The requested path is cut out of the redirect target, so "/random -> /random/" equals "/admin -> /admin/",
+        # and "/login?next=%2Frandom" equals "/login?next=%2Fadmin". The digest is taken without it as well
+        location = strip_path(response.location, path, urlsplit(response.url).path) if response.location else None
+        return response.status, response.content_length // self.length_bucket, response.digest, location
+
+    def same(self, fingerprint, other):
+        status, bucket, digest, location = fingerprint
+        other_status, other_bucket, other_digest, other_location = other
+        if status != other_status or location != other_location:
+            return False
+        if digest is not None and other_digest is not None:
+            return digest == other_digest  # Same length bucket but another body is a different page
+        return bucket == other_bucket
+
+    def learn(self, replies):
+        # A single odd calibration reply may be a real page, a fingerprint needs two replies agreeing on it
+        candidates = [self.fingerprint(response, path) for response, path in replies]
+        for candidate in candidates:
+            if sum(self.same(candidate, other) for other in candidates) >= 2:
+                self.fingerprints.add(candidate)
+
+    def match(self, response, path):
+        fingerprint = self.fingerprint(response, path)
+        return any(self.same(fingerprint, known) for known in self.fingerprints)
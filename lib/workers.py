@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+import multiprocessing
+import queue
+import signal
+from copy import copy
+from time import monotonic
+
+from tqdm import tqdm
+
+from lib.logger import get_logger
+from lib.scan_manager import ScanManager
+from lib.scan_target import prepare_targets
+
+
+class ProgressProxy:
+    """tqdm lookalike forwarding progress of a worker process to the parent"""
+
+    def __init__(self, events, update_interval=0.2):
+        self.events = events
+        self.update_interval = update_interval
+        self.pending = 0
+        self.last_update = monotonic()
+
+    def update(self, n=1):
+        self.pending += n
+        now = monotonic()
+        if now - self.last_update >= self.update_interval:
+            self.flush()
+            self.last_update = now
+
+    def flush(self):
+        if self.pending:
+            self.events.put(("update", self.pending))
+            self.pending = 0
+
+    def write(self, msg):
+        self.events.put(("write", msg))
+
+    def set_postfix_str(self, s="", refresh=True):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class WorkerScanManager(ScanManager):
+    def __init__(self, config, targets, events):
+        self.events = events
+        super().__init__(config, targets)
+
+    def create_progress(self, total):
+        return ProgressProxy(self.events)
+
+    def extend_progress(self, count):
+        self.events.put(("total", count))
+
+    async def report_throughput(self):
+        while True:
+            await asyncio.sleep(1)
+            self.pbar.flush()
+            self.events.put(("rate", self.config.shard_index, self.meter.sample()))
+
+    def setup_sighandler(self):
+        # The parent owns the terminal: Ctrl-C is handled there and turned into SIGTERM for every worker
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for s in (signal.SIGHUP, signal.SIGTERM):
+            self.loop.add_signal_handler(s, lambda s=s: asyncio.create_task(self.shutdown(s)))
+
+
+def run_worker(config, events):
+    manager = WorkerScanManager(config, prepare_targets(config), events)
+    try:
+        manager.run_loop()
+    except (asyncio.exceptions.CancelledError, KeyboardInterrupt):
+        pass
+    finally:
+        manager.pbar.close()
+        events.put(("done", config.shard_index))
+
+
+class WorkerPool:
+    """Runs the scan in several processes, each with its own event loop and connector.
+
+    A target list is sharded by target, a single target by path index. Progress and log messages of
+    every worker are merged into the progress bar of the parent process.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = get_logger('MAIN', 'INFO')
+        self.events = multiprocessing.Queue()
+        self.processes = []
+
+    def shard_config(self, index):
+        count = self.config.workers
+        config = copy(self.config)
+        config.shard_index = index
+        config.shard_count = count
+        config.shard_paths = not self.config.url_list
+        config.max_connections = max(-(-self.config.max_connections // count), 1)
+        if self.config.metrics_file:
+            config.metrics_file = f"{self.config.metrics_file}.{index}"
+        if self.config.metrics_port:
+            config.metrics_port = self.config.metrics_port + index
+        if self.config.rate:
+            config.rate = self.config.rate / count
+            config.burst = max(self.config.burst // count, 1)
+        if config.shard_paths:
+            # Every worker sends its share of the paths to the same host
+            if self.config.max_connections_per_host:
+                config.max_connections_per_host = max(-(-self.config.max_connections_per_host // count), 1)
+            config.initial_window = max(-(-self.config.initial_window // count), 1)
+            if self.config.host_rate:
+                config.host_rate = self.config.host_rate / count
+                config.host_burst = max(self.config.host_burst // count, 1)
+        if self.config.max_active_targets:
+            config.max_active_targets = max(-(-self.config.max_active_targets // count), 1)
+        return config
+
+    def run(self, total):
+        for index in range(self.config.workers):
+            process = multiprocessing.Process(target=run_worker, args=(self.shard_config(index), self.events),
+                                              name=f"pidrila-worker-{index}")
+            process.start()
+            self.processes.append(process)
+        pbar = tqdm(total=total, ascii=True, position=0, leave=False, dynamic_ncols=True)
+        rates = {}
+        running = set(range(self.config.workers))
+        try:
+            while running:
+                try:
+                    event = self.events.get(timeout=0.5)
+                except queue.Empty:
+                    running = {i for i in running if self.processes[i].is_alive()}
+                    continue
+                if event[0] == "update":
+                    pbar.update(event[1])
+                elif event[0] == "total":
+                    pbar.total += event[1]
+                elif event[0] == "write":
+                    pbar.write(event[1])
+                elif event[0] == "rate":
+                    rates[event[1]] = event[2]
+                    pbar.set_postfix_str(f"{sum(rates.values()):.0f} req/s, {len(running)} workers", refresh=False)
+                elif event[0] == "done":
+                    running.discard(event[1])
+        except KeyboardInterrupt:
+            pbar.write("CTRL+C detected: stopping workers...")
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+            raise
+        finally:
+            # Workers still flushing their queue would never exit, keep draining it until they are gone
+            while any(process.is_alive() for process in self.processes):
+                try:
+                    self.events.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+            for process in self.processes:
+                process.join()
+            pbar.refresh()
+            pbar.close()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Author: Enemy Submarine
+
+import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from lib.sinks import make_record, open_sinks
+from lib.util import sizeof_fmt
+
+CLOSE = object()  # Queued instead of a response: close the log of the target once its hits are written
+
+
+def format_hit(response):
+    if response.status in (301, 302) and response.location:
+        url = response.url + ' -> ' + response.location
+    else:
+        url = response.url
+    return f'{str(response.status)} - {sizeof_fmt(response.content_length)}\t-\t{url}'
+
+
+class ResultWriter:
+    """Bounded queue of hits drained into the target logs and the terminal by a single writer thread.
+
+    put() waits while the queue is full, which slows the scanner down instead of growing memory.
+    Records are written in batches of up to flush_size, or every flush_interval seconds. Terminal
+    output is limited to console_rate lines per second, the rest is only counted. Every batch is also
+    passed to the structured output sinks (--output). Hits which arrive after the log of their target
+    was closed are not written to it.
+    """
+
+    def __init__(self, config, console, logger):
+        self.config = config
+        self.console = console
+        self.logger = logger
+        self.sinks = open_sinks(config)
+        self.queue = deque()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.not_empty = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pidrila-writer")
+        self.writing = None
+        self.console_window = monotonic()
+        self.console_shown = 0
+        self.console_suppressed = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def show_on_console(self):
+        if not self.config.console_rate:
+            return True
+        now = monotonic()
+        if now - self.console_window >= 1.0:
+            self.report_suppressed()
+            self.console_window = now
+            self.console_shown = 0
+        if self.console_shown < self.config.console_rate:
+            self.console_shown += 1
+            return True
+        self.console_suppressed += 1
+        return False
+
+    def report_suppressed(self):
+        if self.console_suppressed:
+            self.queue.append((None, f"... {self.console_suppressed} more hits not shown, see the logs", True))
+            self.console_suppressed = 0
+
+    async def put(self, target, response):
+        while len(self.queue) >= self.config.output_queue_size:
+            self.not_full.clear()
+            await self.not_full.wait()
+        self.queue.append((target, response, self.show_on_console()))
+        if len(self.queue) >= self.config.flush_size:
+            self.not_empty.set()
+
+    def close_log(self, target):
+        self.queue.append((target, CLOSE, False))
+        self.not_empty.set()
+
+    def take(self):
+        batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.config.flush_size))]
+        self.not_full.set()
+        return batch
+
+    def write_batch(self, batch):
+        # Runs in the writer thread
+        lines = defaultdict(list)
+        console = []
+        records = []
+        for target, response, show in batch:
+            if response is CLOSE:
+                # A target may be closed twice (given up on, then finished), lines after the first are dropped
+                target_lines = lines.pop(target, None)
+                if target_lines and target.logfile:
+                    target.save_link("".join(target_lines))
+                target.close_log()
+                continue
+            line = response if target is None else format_hit(response)
+            if target is not None:
+                lines[target].append(line + '\n')
+                if self.sinks:
+                    records.append(make_record(target, response))
+            if show:
+                console.append(line)
+        for target, target_lines in lines.items():
+            if target_lines and target.logfile:
+                target.save_link("".join(target_lines))
+        for sink in self.sinks:
+            if records:
+                sink.write(records)
+        for line in console:
+            self.console.info(line)
+
+    async def flush(self):
+        while self.queue:
+            if self.writing:
+                await self.writing
+            self.writing = asyncio.get_event_loop().run_in_executor(self.executor, self.write_batch, self.take())
+            await self.writing
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.not_empty.wait(), self.config.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.not_empty.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # The batch is lost, but a dead writer would leave put() waiting forever
+                self.writing = None
+                self.logger.error(f"Failed to write results: {e!r}")
+
+    async def close(self):
+        # Also safe after the run() task was cancelled during shutdown
+        if self.writing:
+            await asyncio.wait([self.writing])
+        self.writing = None
+        self.report_suppressed()
+        await self.flush()
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+        self.executor.shutdown()